@@ -1,7 +1,15 @@
 from __future__ import unicode_literals
 
+import os
+import sys
+
 from .db import DB
 from .db import SQLiteDB, MSSQLDB, PostgresDB
+from .db import QueryResult, ScriptProgress
+from .pipeline import CopyProgress
+
+if sys.version_info >= (3, 6):
+    from .aio import AsyncDB, AsyncSQLiteDB, AsyncPostgresDB
 
 __author__ = """Garin Wally"""
 __email__ = 'garwall101@gmail.com'
@@ -9,6 +17,27 @@ __version__ = '1.0b1.dev1'
 
 
 options = {
-    "sqlite_datetime_format": u"%Y-%m-%d %H:%M:%S"
+    "sqlite_datetime_format": u"%Y-%m-%d %H:%M:%S",
+    "sqlite_function_cache_size": 1024,
+    "chunksize": 10000,
+    "stream_fetch_size": None,
+    "columnar_fetch": False,
+    "result_typing": False,
+    "template_cache_size": 512,
+    "executemany_batch_size": 5000,
+    "script_batch_size": 1000,
+    "parse_cache_size": 512,
+    "result_cache_max_bytes": 256 * 1024 ** 2,
+    "result_cache_ttl": 600,
+    "pipeline_queue_size": 8,
+    "schema_cache": False,
+    "schema_cache_dir": os.path.join(
+        os.path.expanduser("~"), ".db2", "schema_cache"),
+    "pool_options": {
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_recycle": -1,
+        "pool_pre_ping": False
+        }
 }
 
@@ -0,0 +1,143 @@
+"""
+asyncio interface to the DB classes (Python 3.6+).
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .db import DB, SQLiteDB, PostgresDB
+
+
+__all__ = [
+    "AsyncDB",
+    "AsyncSQLiteDB",
+    "AsyncPostgresDB"
+    ]
+
+
+class AsyncDB(object):
+    """
+    Awaitable wrapper around a DB object. Blocking calls run on an executor
+    so they don't block the event loop; results are the same as the
+    corresponding ``DB`` methods (handlebars templates, multi-statement
+    scripts, etc.).
+
+    Parameters
+    ----------
+    *args, **kwargs:
+        Passed to the wrapped DB class.
+    max_workers: int
+        Number of executor threads. The default of 1 serializes all calls on
+        one connection; more workers require ``pooled=True``.
+
+    Example
+    -------
+    >>> import asyncio
+    >>> from db2 import AsyncSQLiteDB
+    >>> d = AsyncSQLiteDB("tests/chinook.sqlite")
+    >>> loop = asyncio.get_event_loop()
+    >>> df = loop.run_until_complete(d.sql("SELECT * FROM Artist"))
+    >>> len(df)
+    275
+    """
+    _db_class = DB
+
+    def __init__(self, *args, **kwargs):
+        self._max_workers = kwargs.pop("max_workers", 1)
+        if self._max_workers > 1 and not kwargs.get("pooled"):
+            raise AttributeError("max_workers > 1 requires pooled=True")
+        self._executor = ThreadPoolExecutor(self._max_workers)
+        # Connect on the executor's thread; sqlite3 connections can only be
+        # used by the thread that created them
+        self.db = self._executor.submit(
+            partial(self._db_class, *args, **kwargs)).result()
+
+    def _run(self, func, *args, **kwargs):
+        """Runs a blocking function on the executor."""
+        return self._run_on(self._executor, func, *args, **kwargs)
+
+    @staticmethod
+    def _run_on(executor, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+    async def sql(self, sql, data=None, **kwargs):
+        """Awaitable ``DB.sql``."""
+        return await self._run(self.db.sql, sql, data, **kwargs)
+
+    async def load_dataframe(self, df, table_name, **kwargs):
+        """Awaitable ``DB.load_dataframe``."""
+        return await self._run(self.db.load_dataframe, df, table_name,
+                               **kwargs)
+
+    async def execute_script_file(self, filename, data=None, **kwargs):
+        """Awaitable ``DB.execute_script_file``."""
+        return await self._run(self.db.execute_script_file, filename, data,
+                               **kwargs)
+
+    async def stream(self, sql, data=None, chunksize=None):
+        """
+        Asynchronously iterates over the results of ``DB.iter_sql``.
+
+        Example
+        -------
+        >>> async def sizes(d):
+        ...     return [len(df) async for df in d.stream(
+        ...         "SELECT * FROM Artist", chunksize=100)]
+        >>> loop.run_until_complete(sizes(d))  # doctest: +SKIP
+        [100, 100, 75]
+        """
+        # A stream holds its connection until it is consumed, so it must
+        # stay on a single thread
+        if self._max_workers == 1:
+            executor = self._executor
+        else:
+            executor = ThreadPoolExecutor(1)
+        done = object()
+        chunks = None
+        try:
+            # The statements run when the iterator is created
+            chunks = await self._run_on(
+                executor, self.db.iter_sql, sql, data, chunksize)
+            while True:
+                chunk = await self._run_on(executor, next, chunks, done)
+                if chunk is done:
+                    break
+                yield chunk
+        finally:
+            if chunks is not None:
+                await self._run_on(executor, chunks.close)
+            if executor is not self._executor:
+                executor.shutdown(wait=False)
+
+    async def close(self):
+        """Closes the database connection and the executor."""
+        await self._run(self.db.close)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __str__(self):
+        return "Async{}".format(self.db)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class AsyncSQLiteDB(AsyncDB):
+    """
+    Awaitable wrapper around ``SQLiteDB``.
+    """
+    _db_class = SQLiteDB
+
+
+class AsyncPostgresDB(AsyncDB):
+    """
+    Awaitable wrapper around ``PostgresDB``. (WIP)
+    """
+    _db_class = PostgresDB
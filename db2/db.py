@@ -5,29 +5,43 @@ This module contains the DB superclass and all related subclasses.
 
 from __future__ import unicode_literals
 
+import csv
 import datetime
 import os
 import re
 import sqlite3
 import sys
-from collections import OrderedDict
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from decimal import Decimal
+from multiprocessing.pool import ThreadPool
 
 try:
     from urllib import quote_plus
 except ImportError:
     from urllib.parse import quote_plus
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy as np
 import pandas as pd
 import pybars
 import sqlparse
 from pymssql import OperationalError
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, literal_column, text
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.event import listen
-from sqlalchemy.exc import ResourceClosedError
+from sqlalchemy.exc import DatabaseError, ResourceClosedError
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import QueuePool
 
-from . import utils
+import db2
+from . import pipeline, utils
 from .schema import Schema
 
 
@@ -58,6 +72,15 @@ sqlite3.register_adapter(Decimal, utils.sqlite_adapt_decimal)
 # DATABASE OBJECTS / DB SUPERCLASS
 # =============================================================================
 
+# A result of DB.sql_many()
+QueryResult = namedtuple("QueryResult", ["sql", "df", "seconds"])
+ScriptProgress = namedtuple(
+    "ScriptProgress", ["statements", "bytes_read", "total_bytes", "seconds"])
+
+# Statements that a streamed script can't run inside its own transactions
+_TRANSACTION_CONTROL = ("BEGIN", "COMMIT", "END", "ROLLBACK")
+
+
 class DB(object):
     """
     Utility for exploring and querying a database. Cheers yhat / Greg Lamp!
@@ -91,10 +114,18 @@ class DB(object):
         Specify the encoding.
     echo: bool
         Whether or not to repeat queries and messages back to user
+    pooled: bool
+        Check a connection out of the engine's pool for each call to
+        ``sql()`` instead of sharing one connection. Use this to share a DB
+        object between threads.
+    pool_options: dict
+        Pool settings passed to ``create_engine`` when ``pooled`` is True
+        (``pool_size``, ``max_overflow``, ``pool_recycle``,
+        ``pool_pre_ping``). Defaults to ``db2.options["pool_options"]``.
     """
     def __init__(self, url=None, username=None, password=None, hostname=None,
                  port=None, dbname=None, dbtype=None, driver=None,
-                 encoding="utf8", echo=False):
+                 encoding="utf8", echo=False, pooled=False, pool_options=None):
 
         self._encoding = encoding
         # Credentials
@@ -119,17 +150,23 @@ class DB(object):
             self._url = DB._create_url(**self.credentials)
 
         # Create engine
-        self.engine = create_engine(self._url)
+        self._pooled = pooled
+        self.engine = create_engine(
+            self._url, **self._engine_options(pool_options))
 
         # Access DBAPI connection on connect
         listen(self.engine, 'connect', self._on_connect)
-        # Connect
-        self.con = self.engine.connect()
+        # Customize how transactions are started
+        listen(self.engine, 'begin', self._on_begin)
+        # Connect (pooled connections are checked out per thread)
+        self._local = threading.local()
+        self._con = None if pooled else self.engine.connect()
         self.schema = Schema(self)
 
         # Misc
         self._last_result = None
         self._max_return_rows = 10
+        self._result_cache = None
 
     @staticmethod
     def _create_url(**kwargs):
@@ -164,11 +201,80 @@ class DB(object):
         kwargs["port"] = ":{}".format(kwargs["port"]) if kwargs["port"] else ""
         return temp.format(**kwargs)
 
+    def _engine_options(self, pool_options=None):
+        """Returns keyword arguments for ``create_engine``."""
+        if not self._pooled:
+            return {}
+        options = dict(db2.options["pool_options"])
+        options.update(pool_options or {})
+        if self.dbtype == "sqlite":
+            if make_url(self._url).database in (None, "", ":memory:"):
+                raise AttributeError(
+                    "pooled mode requires an on-disk SQLite database")
+            # SQLAlchemy uses a NullPool for SQLite files by default
+            options["poolclass"] = QueuePool
+            options["connect_args"] = {"check_same_thread": False}
+        return options
+
+    @property
+    def con(self):
+        """
+        The SQLAlchemy connection that statements are executed on. In pooled
+        mode this is the connection checked out by the current thread, or the
+        engine itself outside of a checkout.
+        """
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            return con
+        if self._con is None:
+            return self.engine
+        return self._con
+
+    @contextmanager
+    def _checkout(self, force=False):
+        """
+        Checks a connection out of the pool and makes it ``self.con`` for the
+        current thread until the block exits. Nested checkouts reuse the
+        outer connection. Without pooling (and ``force``), yields the shared
+        connection.
+        """
+        if (getattr(self._local, "con", None) is not None
+                or not (self._pooled or force)):
+            yield self.con
+            return
+        con = self.engine.connect()
+        self._local.con = con
+        try:
+            yield con
+        finally:
+            self._local.con = None
+            con.close()
+
     def _on_connect(self, conn, _):
         """Get DBAPI2 Connection."""
         #setattr(self, "con", conn)
         return
 
+    def _on_begin(self, conn):
+        """Called when an SQLAlchemy transaction begins on a connection."""
+        return
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager that runs statements on ``self.con`` inside a single
+        transaction. Commits on success and rolls back on error.
+
+        Example
+        -------
+        >>> d = SQLiteDB(":memory:")
+        >>> with d.transaction():
+        ...     d.sql("CREATE TABLE test (id INT);")  # doctest: +SKIP
+        """
+        with self._checkout() as con:
+            with con.begin():
+                yield con
+
     @property
     def dbname(self):
         """
@@ -191,6 +297,45 @@ class DB(object):
         """
         return sorted(self.engine.table_names())
 
+    @property
+    def _cache_key(self):
+        """Identifies the database in cache file names (its URL)."""
+        return str(self._url)
+
+    def _schema_version(self):
+        """
+        Returns a cheap token that changes whenever the database schema does,
+        used to validate schema snapshots (see ``db2.options["schema_cache"]``).
+        It includes the database's identity, so a snapshot can't validate
+        against another database. ``None`` disables the snapshot cache.
+        """
+        return None
+
+    def _estimate_count(self, table_name):
+        """
+        Returns the approximate number of rows in a table from the database's
+        statistics without scanning it, or ``None`` if there is no estimate.
+        """
+        return None
+
+    def _random(self):
+        """Returns an expression that is random for each row."""
+        return func.random()
+
+    def _unordered(self):
+        """
+        Returns an ORDER BY expression for reading past an OFFSET in no
+        particular order, or ``None`` if the database doesn't need one.
+        """
+        return None
+
+    def _tablesample(self, table, frac):
+        """
+        Returns ``table`` sampled down to roughly ``frac`` of its rows by the
+        database (e.g. ``TABLESAMPLE``), or ``None`` if it can't.
+        """
+        return None
+
     def get_schema(self):
         raise(NotImplementedError(
             'This is an abstract method intended to be overwritten'))
@@ -232,6 +377,32 @@ class DB(object):
         """
         return ["\?", "\:\w+"]  # Default for SQLite (?, and :var style)
 
+    # Compiled handlebars templates shared by all DB objects in the process
+    _templates = utils.LRUCache()
+
+    @staticmethod
+    def _compile_template(sql):
+        """
+        Returns a compiled handlebars template for ``sql``, compiling it only
+        if it is not already cached. The cache size is set by
+        ``db2.options["template_cache_size"]``.
+        """
+        cache = DB._templates
+        cache.maxsize = db2.options["template_cache_size"]
+        template = cache.get(sql)
+        if template is None:
+            template = pybars.Compiler().compile(sql)
+            cache.put(sql, template)
+        return template
+
+    @staticmethod
+    def template_cache_info():
+        """
+        Returns the hits, misses, size and maxsize of the compiled template
+        cache.
+        """
+        return DB._templates.info()
+
     @staticmethod
     def _apply_handlebars(sql, data, union=True):
         """
@@ -262,7 +433,7 @@ class DB(object):
         """
         if (sys.version_info < (3, 0)):
             sql = unicode(sql)
-        template = pybars.Compiler().compile(sql)
+        template = DB._compile_template(sql)
         has_semicolon = True if sql.endswith(";") else False
         if isinstance(data, list):
             query = [template(item) for item in data]
@@ -336,7 +507,96 @@ class DB(object):
 
     def _concat_dfs(sqlfunc):
         """Decorates DB.sql()."""
-        def sql_wrapper(d, sql, data=None):
+        def is_union(sql, parsed):
+            """Identify a handlebars-style query that needs to be UNIONed."""
+            return (len(parsed) == 1 and "{{" in sql
+                    and parsed[0].is_query and ";" not in sql)
+
+        def summarize(dfs):
+            """Concatenate statement results as a 'SQL' / 'Result' frame."""
+            ix = 0
+            for df in dfs:
+                if df.columns.tolist() != ["SQL", "Result"]:
+                    dfs[ix] = df.T.reset_index().rename(
+                        {"index": "SQL", 0: "Result"}, axis=1)
+                ix += 1
+            return pd.concat(dfs).reset_index(drop=True)
+
+        def iter_wrapper(d, sql, data, chunksize):
+            """
+            Iterator behind ``DB.sql(..., chunksize=n)``. Statements run
+            before it returns; only the rows of the query, which must be the
+            last statement, are read as the iterator is consumed.
+            """
+            parsed = utils.split_sql(sql)
+            if is_union(sql, parsed):
+                sql = d._apply_handlebars(sql, data, union=True)
+                con = d._streaming(d.con, chunksize)
+                return pd.read_sql(sql, con, chunksize=chunksize)
+            queries = [i for i, stmt in enumerate(parsed) if stmt.is_query]
+            if queries and queries != [len(parsed) - 1]:
+                raise AttributeError(
+                    "chunksize can only stream one query, which must be the "
+                    "last statement")
+
+            # Hold the connection until the results are consumed
+            checkout = d._checkout()
+            checkout.__enter__()
+            dfs = []
+            try:
+                for stmt in parsed:
+                    result = sqlfunc(d, stmt.value, data, chunksize)
+                    if stmt.is_query:
+                        break
+                    if not isinstance(result, pd.DataFrame):
+                        # Rows from a statement that isn't parsed as a query
+                        result = pd.concat(list(result), ignore_index=True)
+                    dfs.append(result)
+            except BaseException:
+                checkout.__exit__(*sys.exc_info())
+                raise
+            finally:
+                # Statements before the query may have changed any table
+                if dfs:
+                    d._invalidate_results()
+            if not queries:
+                checkout.__exit__(None, None, None)
+                return (df for df in [summarize(dfs)])
+
+            def stream():
+                try:
+                    if isinstance(result, pd.DataFrame):
+                        yield result
+                    else:
+                        for chunk in result:
+                            yield chunk
+                finally:
+                    checkout.__exit__(None, None, None)
+            return stream()
+
+        def execute(d, sql, data, parsed):
+            """Executes parsed statements and builds the result."""
+            dfs = []
+            if is_union(sql, parsed):
+                sql = d._apply_handlebars(sql, data, union=True)
+                return pd.read_sql(sql, d.engine)
+
+            # Iterate over statements passed. Single statements that iterate
+            # over data (executemany) will occur inside the sqlfunc
+            with d._checkout():
+                for stmt in parsed:
+                    dfs.append(sqlfunc(d, stmt.value, data))
+            # If a select query is in the tuple of parsed statements, we don't
+            # want to concat with a success DataFrame showing SQL and Result
+            try:
+                return dfs[parsed.index(
+                    [s for s in parsed if s.is_query][0])]
+            except IndexError:
+                pass
+
+            return summarize(dfs)
+
+        def sql_wrapper(d, sql, data=None, chunksize=None):
             """
             Executes one or more SQL statements.
 
@@ -349,6 +609,12 @@ class DB(object):
             data: dict, tuple; or list or tuple of tuples or dicts
                 A container of variables to pass to placeholders in the SQL at
                 runtime.
+            chunksize: int
+                If specified, return an iterator of DataFrames with at most
+                ``chunksize`` rows each. The statements run right away, but
+                rows are pulled from the cursor with ``fetchmany`` as the
+                iterator is consumed. A script can stream one query, which
+                must be its last statement.
 
             Returns
             -------
@@ -356,57 +622,41 @@ class DB(object):
                 A DataFrame containing the results of a SELECT query, or an
                 echo of the statement and number of successful operations.
             """
-            dfs = []
-            parsed = sqlparse.parse(sql)
-
-            # Identify a handlebars-style statement that needs to be UNIONed
-            if (len(parsed) == 1 and "{{" in sql
-                    and utils.is_query(parsed[0]) and ";" not in sql):
-                sql = d._apply_handlebars(sql, data, union=True)
-                return pd.read_sql(sql, d.engine)
-
-            # Append floating 'END;' statements to the statements preceding them
-            lower_parsed = [i.value.strip().lower() for i in parsed]
-            if "end;" in lower_parsed:
-                indices = [i for i, x in enumerate(lower_parsed) if x == "end;"]
-                indices.sort(reverse=True)
-                parsed_list = list(parsed)
-                for i in indices:
-                    parsed_list[i-1].value += "\nEND;"
-                    parsed_list.pop(i)
-                parsed = tuple(parsed_list)
-                    
-            # Iterate over statements passed. Single statements that iterate
-            # over data (executemany) will occur inside the sqlfunc
-            for stmt in parsed:
-                dfs.append(sqlfunc(d, stmt.value, data))
-            # If a select query is in the tuple of parsed statements, we don't
-            # want to concat with a success DataFrame showing SQL and Result
+            if chunksize:
+                return iter_wrapper(d, sql, data, chunksize)
+
+            parsed = utils.split_sql(sql)
+            cache = d._result_cache
+            if cache is None:
+                return execute(d, sql, data, parsed)
+
+            # Serve read-only queries from the result cache
+            if all(s.is_query for s in parsed):
+                key = cache.make_key(sql, data)
+                df = cache.get(key)
+                if df is None:
+                    df = execute(d, sql, data, parsed)
+                    cache.put(key, df)
+                return df.copy()
             try:
-                return dfs[parsed.index(
-                    [s for s in parsed if utils.is_query(s)][0])]
-            except IndexError:
-                pass
-
-            ix = 0
-            for df in dfs:
-                if df.columns.tolist() != ["SQL", "Result"]:
-                    dfs[ix] = df.T.reset_index().rename(
-                        {"index": "SQL", 0: "Result"}, axis=1)
-                ix += 1
-            return pd.concat(dfs).reset_index(drop=True)
+                return execute(d, sql, data, parsed)
+            finally:
+                # The statements may have changed any table
+                cache.invalidate()
         return sql_wrapper
 
     @_concat_dfs
-    def sql(self, sql, data=None):
+    def sql(self, sql, data=None, chunksize=None):
         # This is ugly, but if it ain't broke, it don't need fixin'
         # Apply handlebars to single statement
         many = False
+        # Read chunks through a server-side cursor where supported
+        con = self._streaming(self.con, chunksize) if chunksize else self.con
         if isinstance(data, dict) and "{{" in sql:
             sql = self._apply_handlebars(sql, data)
             if self._echo:
                 print(sql)
-            rprox = self.con.execute(sql)
+            rprox = con.execute(sql)
 
         # Use placeholders/variables
         elif data is not None:
@@ -414,32 +664,51 @@ class DB(object):
             if (isinstance(data, (list, tuple))
                     and isinstance(data[0], (dict, tuple))):
                 many = True
-                for dat in data:
-                    # Iteratively apply handlebars to statement
-                    if "{{" in sql:
+                # Iteratively apply handlebars to statement
+                if "{{" in sql:
+                    for dat in data:
                         s = self._apply_handlebars(sql, dat)  # TODO: log SQL
                         if self._echo:
                             print(sql)
                         rprox = self.con.execute(s)
-                    else:
+                # Queries can't use executemany; run them row by row
+                elif any(s.is_query for s in utils.split_sql(sql)):
+                    for dat in data:
                         if self._echo:
                             print(sql)
                         rprox = self.con.execute(sql, dat)
+                # Pass batches of rows to the DBAPI's executemany
+                else:
+                    if self._echo:
+                        print(sql)
+                    batch_size = db2.options["executemany_batch_size"]
+                    with self.transaction():
+                        for batch in utils.chunks(data, batch_size):
+                            rprox = self.con.execute(sql, batch)
             # Execute single with placeholders/variables
             else:
                 if self._echo:
                     print(sql)
-                rprox = self.con.execute(sql, data)
+                rprox = con.execute(sql, data)
         else:
             # Execute single statement without placeholders/variables
             if self._echo:
                 print(sql)
-            rprox = self.con.execute(sql)
+            rprox = con.execute(sql)
 
         # Get column names
         columns = rprox.keys()
+        dtypes = None
         if len(columns) == 0:
             columns = ["SQL", "Result"]
+        else:
+            if db2.options["result_typing"]:
+                dtypes = self._result_dtypes(rprox.cursor.description)
+            # Stream the rows in chunks
+            if chunksize:
+                return self._iter_chunks(rprox, columns, chunksize, dtypes)
+            elif db2.options["columnar_fetch"]:
+                return self._fetch_columnar(rprox, columns, dtypes)
 
         # Get the results
         try:
@@ -459,9 +728,250 @@ class DB(object):
             else:
                 results = None
 
-        return pd.DataFrame(results, columns=columns)
+        df = pd.DataFrame(results, columns=columns)
+        if dtypes is not None:
+            utils.apply_dtypes(df, dtypes)
+        return df
 
-    def execute_script_file(self, filename, data=None):
+    @staticmethod
+    def _iter_chunks(rprox, columns, chunksize, dtypes=None):
+        """
+        Yields DataFrames of at most ``chunksize`` rows from a result proxy.
+        An empty result yields a single empty DataFrame.
+        """
+        empty = True
+        try:
+            while True:
+                rows = rprox.fetchmany(chunksize)
+                if not rows:
+                    break
+                empty = False
+                df = pd.DataFrame(rows, columns=columns)
+                if dtypes is not None:
+                    utils.apply_dtypes(df, dtypes)
+                yield df
+        finally:
+            rprox.close()
+        if empty:
+            yield pd.DataFrame(None, columns=columns)
+
+    def _result_dtypes(self, description):
+        """
+        Picks the kind of dtype for each result column before it's fetched
+        (see ``utils.apply_dtypes``): the reflected type of a column with the
+        same name, else the cursor description's type code. Enabled by
+        ``db2.options["result_typing"]``.
+        """
+        reflected = {}
+        # Only use what has been reflected already
+        if "meta" in self.schema.__dict__:
+            reflected = self.schema._column_type_map()
+        dbapi = self.engine.dialect.dbapi
+        dtypes = []
+        for desc in description:
+            if desc[0] in reflected:
+                dtypes.append(utils.sa_type_dtype(reflected[desc[0]]))
+            else:
+                kind = utils.column_kind(desc[1], dbapi)
+                dtypes.append(None if kind == "object" else kind)
+        return dtypes
+
+    def _fetch_columnar(self, rprox, columns, dtypes=None):
+        """
+        Fetches a result into one typed NumPy array per column, or an Arrow
+        table if the driver's cursor supports it, rather than building the
+        DataFrame from a list of rows. Enabled by
+        ``db2.options["columnar_fetch"]``.
+        """
+        cursor = rprox.cursor
+        try:
+            if hasattr(cursor, "fetch_arrow_table"):
+                df = cursor.fetch_arrow_table().to_pandas()
+                df.columns = columns
+                return df
+            dbapi = self.engine.dialect.dbapi
+            description = cursor.description
+            kinds = None
+            batches = [[] for _ in columns]
+            while True:
+                rows = rprox.fetchmany(db2.options["chunksize"])
+                if not rows:
+                    break
+                values = list(zip(*rows))
+                if kinds is None:
+                    # Type codes, or the first non-NULL value of each column
+                    kinds = [utils.column_kind(
+                        desc[1], dbapi, next(
+                            (v for v in col if v is not None), None))
+                             for desc, col in zip(description, values)]
+                for batch, col, kind in zip(batches, values, kinds):
+                    batch.append(utils.column_array(col, kind))
+        finally:
+            rprox.close()
+        if kinds is None:
+            return pd.DataFrame(None, columns=columns)
+        # Columns are positional in case of duplicate names
+        df = pd.DataFrame(OrderedDict(
+            (i, batch[0] if len(batch) == 1 else np.concatenate(batch))
+            for i, batch in enumerate(batches)))
+        df.columns = columns
+        if dtypes is not None:
+            utils.apply_dtypes(df, dtypes)
+        return df
+
+    def iter_sql(self, sql, data=None, chunksize=None):
+        """
+        Executes SQL and returns an iterator over the results as DataFrames
+        of bounded size (see ``DB.sql``).
+
+        Parameters
+        ----------
+        sql: str
+            The SQL to be executed (see ``DB.sql``).
+        data: dict, tuple; or list or tuple of tuples or dicts
+            A container of variables to pass to placeholders in the SQL.
+        chunksize: int
+            Maximum number of rows per DataFrame. Defaults to
+            ``db2.options["chunksize"]``.
+
+        Example
+        -------
+        >>> d = SQLiteDB("tests/chinook.sqlite")
+        >>> [len(df) for df in d.iter_sql("SELECT * FROM Artist", chunksize=100)]
+        [100, 100, 75]
+        """
+        if not chunksize:
+            chunksize = db2.options["chunksize"]
+        return self.sql(sql, data, chunksize=chunksize)
+
+    @property
+    def _concurrent_reads(self):
+        """
+        Whether queries can run concurrently on separate connections from
+        ``self.engine``.
+        """
+        return True
+
+    # Whether the driver can stream results from a server-side cursor
+    _server_side_cursors = False
+
+    def _streaming(self, con, chunksize):
+        """
+        Returns ``con`` set to read results through a server-side cursor,
+        buffering at most ``db2.options["stream_fetch_size"]`` (default:
+        ``chunksize``) rows on the client, if the driver supports it.
+        """
+        if not self._server_side_cursors:
+            return con
+        fetch_size = db2.options["stream_fetch_size"] or chunksize
+        return con.execution_options(stream_results=True,
+                                     max_row_buffer=fetch_size)
+
+    def sql_many(self, queries, max_workers=4):
+        """
+        Runs independent queries concurrently on a pool of threads, each
+        with its own connection from the engine.
+
+        Parameters
+        ----------
+        queries: list
+            SQL strings, or ``(sql, data)`` tuples, to pass to ``DB.sql``.
+        max_workers: int
+            Maximum number of queries to run at once.
+
+        Returns
+        -------
+        list:
+            A ``QueryResult(sql, df, seconds)`` for each query, in the same
+            order as ``queries``.
+
+        Example
+        -------
+        >>> d = SQLiteDB("tests/chinook.sqlite")
+        >>> results = d.sql_many(["SELECT * FROM Artist", "SELECT * FROM Album"])
+        >>> [len(r.df) for r in results]
+        [275, 347]
+        """
+        queries = [q if isinstance(q, (list, tuple)) else (q, None)
+                   for q in queries]
+        # Queries that can't have their own connection share self.con
+        force = self._concurrent_reads
+        if not force:
+            max_workers = 1
+
+        def run(query):
+            sql, data = query
+            with self._checkout(force=force):
+                start = time.time()
+                df = self.sql(sql, data)
+            return QueryResult(sql, df, time.time() - start)
+
+        if max_workers <= 1 or len(queries) <= 1:
+            return [run(q) for q in queries]
+        pool = ThreadPool(min(max_workers, len(queries)))
+        try:
+            return pool.map(run, queries)
+        finally:
+            pool.close()
+            pool.join()
+
+    @property
+    def result_cache(self):
+        """
+        The ``utils.ResultCache`` used by ``sql()``, or None if result caching
+        is disabled. Use ``result_cache.info()`` for its hit rate and memory
+        used.
+        """
+        return self._result_cache
+
+    def enable_result_cache(self, max_bytes=None, ttl=None):
+        """
+        Caches the results of read-only queries run through ``sql()``.
+
+        Results are keyed by the normalized SQL and its parameters. Running
+        any non-query statement with ``sql()`` empties the cache, while
+        ``load_dataframe`` and ``create_table_as`` drop the results that
+        reference the table they write to.
+
+        Parameters
+        ----------
+        max_bytes: int
+            Memory cap for the cached DataFrames; least recently used results
+            are evicted first. Defaults to
+            ``db2.options["result_cache_max_bytes"]``.
+        ttl: int, float, None
+            Seconds before a cached result expires. Defaults to
+            ``db2.options["result_cache_ttl"]``; None never expires.
+
+        Example
+        -------
+        >>> d = SQLiteDB("tests/chinook.sqlite")
+        >>> d.enable_result_cache()
+        >>> artists = d.sql("SELECT * FROM Artist")
+        >>> artists = d.sql("SELECT  *  FROM Artist;")
+        >>> d.result_cache.info()["hit_rate"]
+        0.5
+        """
+        if max_bytes is None:
+            max_bytes = db2.options["result_cache_max_bytes"]
+        if ttl is None:
+            ttl = db2.options["result_cache_ttl"]
+        self._result_cache = utils.ResultCache(max_bytes, ttl)
+        return
+
+    def disable_result_cache(self):
+        """Disables and empties the result cache."""
+        self._result_cache = None
+        return
+
+    def _invalidate_results(self, table_name=None):
+        """Drops cached results for a table (or all cached results)."""
+        if self._result_cache is not None:
+            self._result_cache.invalidate(table_name)
+        return
+
+    def execute_script_file(self, filename, data=None, stream=False,
+                            batch_size=None, progress=None):
         """
         Executes an SQL script from a file.
 
@@ -472,19 +982,71 @@ class DB(object):
             Path to the file containing SQL to be executed.
         data: dict
             Dictionary mapping script variables to values via PyBars.
+        stream: bool
+            Read, split and execute the script incrementally so memory use
+            doesn't grow with the size of the file (e.g. to restore dumps).
+            Statements run in transactions of ``batch_size``; the script's
+            own BEGIN/COMMIT statements are skipped and query results are
+            discarded.
+        batch_size: int
+            Statements per transaction when streaming (default:
+            ``db2.options["script_batch_size"]``).
+        progress: function
+            Called with a ``ScriptProgress(statements, bytes_read,
+            total_bytes, seconds)`` after each batch when streaming. Progress
+            is also printed if the DB was created with ``echo=True``.
 
         Returns
         -------
         DataFrame:
-            The DataFrame produced from executing the SQL statement(s).
+            The DataFrame produced from executing the SQL statement(s). When
+            streaming, a single 'SQL' / 'Result' row with the filename and
+            the number of statements executed.
         """
         if not os.path.exists(filename):
             raise AttributeError("input file not found")
+        if stream:
+            return self._stream_script_file(
+                filename, data, batch_size, progress)
         with open(filename, "r") as f:
             script = self._apply_handlebars(f.read(), data)
         return self.sql(script)
 
-    def load_dataframe(self, df, table_name, **kwargs):
+    def _stream_script_file(self, filename, data, batch_size, progress):
+        """Executes a script file as it is read (see execute_script_file)."""
+        if not batch_size:
+            batch_size = db2.options["script_batch_size"]
+        total_bytes = os.path.getsize(filename)
+        start = time.time()
+        count = 0
+        try:
+            with open(filename, "rb") as f, self._checkout():
+                lines = (line.decode(self._encoding) for line in f)
+                for batch in utils.chunks(utils.iter_statements(lines),
+                                          batch_size):
+                    with self.transaction():
+                        for stmt in batch:
+                            keyword = utils.statement_keyword(stmt)
+                            if keyword in _TRANSACTION_CONTROL:
+                                continue
+                            if data and "{{" in stmt:
+                                stmt = self._apply_handlebars(stmt, data)
+                            self.con.execute(stmt).close()
+                            count += 1
+                    status = ScriptProgress(count, f.tell(), total_bytes,
+                                            time.time() - start)
+                    if progress:
+                        progress(status)
+                    if self._echo:
+                        print("{}: {} statements, {:.0%} ({:.1f}s)".format(
+                            filename, count,
+                            float(status.bytes_read) / max(total_bytes, 1),
+                            status.seconds))
+        finally:
+            self._invalidate_results()
+        return pd.DataFrame([[filename, count]], columns=["SQL", "Result"])
+
+    def load_dataframe(self, df, table_name, method=None, **kwargs):
         """
         Loads a DataFrame as a database table. (WIP)
 
@@ -499,19 +1061,69 @@ class DB(object):
             DataFrame object to load into database as a table
         table_name: str
             Name of table to create
+        method: str, callable, None
+            Use ``"fast"`` to bulk load the rows with the database's native
+            fast path in a single transaction. Other values are passed to
+            ``df.to_sql()``.
         **kwargs: dict
             Passed to ``df.to_sql()``
+
+        Returns
+        -------
+        dict, None:
+            For ``method="fast"``, the table name, number of rows, seconds
+            elapsed and rows per second.
         """
         kwargs.setdefault("index", False)
         # TODO: column name requirements
 
-        df.to_sql(table_name, self.engine, **kwargs)
+        if method != "fast":
+            df.to_sql(table_name, self.engine, method=method, **kwargs)
+            self._invalidate_results(table_name)
+            return
+
+        start = time.time()
+        with self._checkout(), self._bulk_load():
+            with self.transaction():
+                df.to_sql(table_name, self.con, method=self._bulk_insert,
+                          **kwargs)
+        seconds = time.time() - start
+        self._invalidate_results(table_name)
+        stats = {
+            "table": table_name,
+            "rows": len(df),
+            "seconds": seconds,
+            "rows_per_sec": len(df) / seconds if seconds else float(len(df))
+            }
+        if self._echo:
+            print("Loaded {rows} rows into {table} in {seconds:.2f}s "
+                  "({rows_per_sec:,.0f} rows/sec)".format(**stats))
+        return stats
+
+    @contextmanager
+    def _bulk_load(self):
+        """Prepares the connection for a ``load_dataframe`` bulk load."""
+        yield
+
+    def _bulk_insert(self, pd_table, conn, keys, data_iter):
+        """
+        Inserts rows for ``load_dataframe(method="fast")``. Implements the
+        insert method interface of ``DataFrame.to_sql()``; subclasses replace
+        this with a native fast path.
+        """
+        conn.execute(pd_table.table.insert(),
+                     [dict(zip(keys, row)) for row in data_iter])
         return
 
+    # DataFrame.to_excel options that export_tables_to_excel supports
+    _to_excel_options = ("index", "header", "na_rep", "float_format",
+                         "freeze_panes")
+
     def export_tables_to_excel(self, tables, excel_path, where_clauses=None,
                                strip_regex=None, **kwargs):
         """
-        Exports a list of tables to sheets in an Excel document.
+        Exports a list of tables to sheets in an Excel document. Tables are
+        streamed to the workbook in chunks (see ``export_tables``).
 
         Parameters
         ----------
@@ -523,6 +1135,9 @@ class DB(object):
                 A list of 'WHERE <clause>' or '' for each table.
             strip_regex: str
                 A regular expression used to clean output sheet names.
+            **kwargs:
+                The ``DataFrame.to_excel`` options ``index``, ``header``,
+                ``na_rep``, ``float_format`` and ``freeze_panes``.
 
         Example
         -------
@@ -540,21 +1155,61 @@ class DB(object):
         ...     ["Artist"], excel_out, ["WHERE ArtistId = 1"])
         >>> excel_out.close()  # Delete the tempfile
         """
-        writer = pd.ExcelWriter(excel_path, engine='xlsxwriter')
-        if not where_clauses:
-            where_clauses = [''] * len(tables)
-        tables = zip(tables, where_clauses)
-        for tbl, where in tables:
-            sheet_name = tbl
-            if strip_regex:
-                sheet_name = re.sub(strip_regex, "", sheet_name)
-            df = self.sql(
-                "SELECT * FROM {{ tbl }} {{ where }}",
-                data={"tbl": tbl, "where": where})
-            df.to_excel(writer, sheet_name=sheet_name, **kwargs)
-        writer.save()
+        unsupported = set(kwargs) - set(self._to_excel_options)
+        if unsupported:
+            raise AttributeError(
+                "unsupported option(s) for streamed Excel exports: {}; use "
+                "{}".format(", ".join(sorted(unsupported)),
+                            ", ".join(self._to_excel_options)))
+        # Like DataFrame.to_excel, include the index by default
+        kwargs.setdefault("index", True)
+        self.export_tables(tables, excel_path, "xlsx", where_clauses,
+                           strip_regex, **kwargs)
         return
 
+    def export_tables(self, tables, path, file_format=None,
+                      where_clauses=None, strip_regex=None, chunksize=None,
+                      max_workers=1, **kwargs):
+        """
+        Streams tables to an Excel workbook or to CSV, JSON-lines or Parquet
+        files (see ``db2.pipeline.export_tables``).
+
+        Example
+        -------
+        >>> d = SQLiteDB("tests/chinook.sqlite")
+        >>> d.export_tables(["Artist", "Album"], "exports",
+        ...                 "csv")  # doctest: +SKIP
+        """
+        return pipeline.export_tables(
+            self, tables, path, file_format, where_clauses, strip_regex,
+            chunksize, max_workers, **kwargs)
+
+    def copy_table(self, table_name, dst, target_name=None, if_exists="fail",
+                   chunksize=None, progress=None):
+        """
+        Copies a table to another database, reading chunks from this one
+        while a writer thread bulk loads them into ``dst``. Column types are
+        mapped from the reflected schema (see ``db2.pipeline.copy_table``).
+
+        Example
+        -------
+        >>> d = SQLiteDB("tests/chinook.sqlite")
+        >>> copy = SQLiteDB(":memory:")
+        >>> d.copy_table("Artist", copy, chunksize=100)["rows"]
+        275
+        """
+        return pipeline.copy_table(self, dst, table_name, target_name,
+                                   if_exists, chunksize, progress)
+
+    def copy_query(self, sql, dst, target_name, data=None, if_exists="fail",
+                   chunksize=None, progress=None):
+        """
+        Copies the results of a query into a table of another database (see
+        ``db2.pipeline.copy_query``).
+        """
+        return pipeline.copy_query(self, dst, sql, target_name, data,
+                                   if_exists, chunksize, progress)
+
     def create_mapping(self, mapping):
         """Creates a table from a mapping object."""
         mapping.__table__.create(self.engine)
@@ -563,7 +1218,8 @@ class DB(object):
     def close(self):
         """Close the database connection."""
         # TODO: after running this, on-disk SQLite databases are still locked
-        self.engine.dispose()
+        if hasattr(self, "engine"):
+            self.engine.dispose()
         return
 
     def __del__(self):
@@ -593,16 +1249,140 @@ class SQLiteDB(DB):
         Whether or not to repeat queries and messages back to user
     extensions: list
         List of extensions to load on connection
+    pooled: bool
+        Check a connection out of a pool for each call to ``sql()`` (on-disk
+        databases only). Extensions, pragmas and functions are loaded on
+        every pooled connection.
+    pool_options: dict
+        Pool settings passed to ``create_engine`` (see ``DB``).
+    pragma_profile: str, list
+        Name of a performance profile in ``SQLiteDB.pragma_profiles``
+        ("bulk_load", "read_heavy" or "durable"), or a list of (pragma,
+        value) pairs, applied to every connection before ``pragmas``.
     """
+    # Named performance profiles: (pragma, value) pairs applied in order
+    pragma_profiles = {
+        "bulk_load": [
+            ("synchronous", "OFF"),
+            ("cache_size", -65536),
+            ("temp_store", "MEMORY")
+            ],
+        "read_heavy": [
+            # Only affects new (or vacuumed, non-WAL) databases
+            ("page_size", 16384),
+            ("journal_mode", "WAL"),
+            ("synchronous", "NORMAL"),
+            ("mmap_size", 268435456),
+            ("cache_size", -65536),
+            ("temp_store", "MEMORY")
+            ],
+        "durable": [
+            ("journal_mode", "WAL"),
+            ("synchronous", "FULL"),
+            ("mmap_size", 0)
+            ]
+        }
+
+    # Allowed values of the pragmas that profiles can set (None: integers)
+    _pragma_choices = {
+        "journal_mode": ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL",
+                         "OFF"),
+        "synchronous": ("OFF", "NORMAL", "FULL", "EXTRA", 0, 1, 2, 3),
+        "temp_store": ("DEFAULT", "FILE", "MEMORY", 0, 1, 2),
+        "cache_size": None,
+        "mmap_size": None,
+        "page_size": None
+        }
+
     def __init__(self, dbname, echo=False, extensions=None, functions=None,
-                 pragmas=None):
+                 pragmas=None, pooled=False, pool_options=None,
+                 pragma_profile=None):
         self._extensions = extensions
         self._functions = functions
         self._pragmas = [] if not pragmas else pragmas
+        self._profile_pragmas = []
+        if pragma_profile is not None:
+            self._profile_pragmas = self._validate_pragmas(pragma_profile)
         super(SQLiteDB, self).__init__(
             dbname=dbname,
             dbtype="sqlite",
-            echo=echo)
+            echo=echo,
+            pooled=pooled,
+            pool_options=pool_options)
+
+    # Statements that make a script return rows ("auto" mode won't run them)
+    _query_keywords = ("SELECT", "WITH", "VALUES", "PRAGMA", "EXPLAIN")
+
+    def sql(self, sql, data=None, chunksize=None, mode=None):
+        """
+        Executes one or more SQL statements (see ``DB.sql``).
+
+        Parameters
+        ----------
+        mode: str
+            "script" hands the SQL to the sqlite3 ``executescript`` in a
+            single transaction, without parsing each statement or building a
+            DataFrame for it; any query results are discarded. "auto" uses
+            script mode for multi-statement scripts without queries or
+            placeholder data. Inside ``transaction()``, which
+            ``executescript`` would commit, "script" raises an
+            AttributeError and "auto" runs the statements one by one. Returns one 'SQL' / 'Result' row with the
+            script and its number of statements.
+        """
+        if mode not in (None, "script", "auto"):
+            raise AttributeError("mode must be 'script' or 'auto'")
+        if mode is not None and data is None and not chunksize:
+            statements = list(utils.iter_statements(sql.splitlines(True)))
+            keywords = [utils.statement_keyword(s) for s in statements]
+            script = mode == "script" or (
+                len(statements) > 1
+                and not set(keywords) & set(self._query_keywords))
+            # executescript would commit the open transaction first
+            raw = getattr(self.con, "connection", None)
+            if script and raw is not None and raw.in_transaction:
+                if mode == "script":
+                    raise AttributeError(
+                        "mode='script' can't be used inside a transaction")
+            elif script:
+                return self._execute_script(sql, keywords)
+        elif mode == "script":
+            raise AttributeError(
+                "mode='script' can't be used with data or chunksize")
+        return super(SQLiteDB, self).sql(sql, data, chunksize)
+
+    def _execute_script(self, sql, keywords):
+        """
+        Runs a script with ``executescript``, wrapped in a transaction unless
+        the script manages its own.
+        """
+        if self._echo:
+            print(sql)
+        script = sql
+        wrap = not set(keywords) & set(_TRANSACTION_CONTROL)
+        if wrap:
+            # The extra ';' ends a last statement without one
+            script = "BEGIN;\n{};\nCOMMIT;".format(sql)
+        try:
+            with self._checkout() as con:
+                raw = con.connection
+                try:
+                    raw.executescript(script)
+                except Exception:
+                    if wrap and raw.in_transaction:
+                        raw.execute("ROLLBACK;")
+                    raise
+        finally:
+            self._invalidate_results()
+        return pd.DataFrame([[sql.strip(), len(keywords)]],
+                            columns=["SQL", "Result"])
+
+    def _on_begin(self, conn):
+        """
+        Emit BEGIN ourselves; pysqlite won't since ``isolation_level`` is
+        set to None on connect.
+        """
+        conn.execute("BEGIN;")
+        return
 
     def _on_connect(self, conn, _):
         """Get DBAPI2 Connection and load all specified extensions."""
@@ -611,15 +1391,145 @@ class SQLiteDB(DB):
         if isinstance(self._extensions, list):
             for ext in self._extensions:
                 conn.load_extension(ext)
-        for pragma in self._pragmas:
+        for pragma in self._profile_pragmas + list(self._pragmas):
             conn.execute("PRAGMA {}={};".format(pragma[0], pragma[1]))
         # Load Python functions into the database for use in SQL
         if isinstance(self._functions, list):
-            for func in self._functions:
+            for function in self._functions:
                 # For each function in the list
-                utils.make_sqlite_function(conn, func)
+                utils.make_sqlite_function(conn, function)
         return
 
+    def _validate_pragmas(self, profile):
+        """
+        Returns the (pragma, value) pairs of a profile name or list of pairs,
+        raising an AttributeError for unknown profiles, pragmas or values.
+        """
+        if isinstance(profile, str):
+            if profile not in self.pragma_profiles:
+                raise AttributeError(
+                    "unknown pragma profile '{}'".format(profile))
+            profile = self.pragma_profiles[profile]
+        settings = []
+        for name, value in profile:
+            if name not in self._pragma_choices:
+                raise AttributeError("unsupported pragma '{}'".format(name))
+            choices = self._pragma_choices[name]
+            if isinstance(value, str):
+                value = value.upper()
+            if choices is None:
+                valid = isinstance(value, int) and not isinstance(value, bool)
+                if valid and name == "page_size":
+                    # A power of two from 512 to 65536
+                    valid = 512 <= value <= 65536 and not value & (value - 1)
+                elif valid and name == "mmap_size":
+                    valid = value >= 0
+            else:
+                valid = value in choices
+            if not valid:
+                raise AttributeError(
+                    "invalid value for pragma '{}': {}".format(name, value))
+            settings.append((name, value))
+        return settings
+
+    @contextmanager
+    def pragmas(self, profile):
+        """
+        Context manager that applies a pragma profile (or a list of (pragma,
+        value) pairs) to the connection, restoring the previous values on
+        exit.
+
+        Example
+        -------
+        >>> d = SQLiteDB(":memory:")
+        >>> with d.pragmas("bulk_load"):
+        ...     d.load_dataframe(df, "test")  # doctest: +SKIP
+        """
+        settings = self._validate_pragmas(profile)
+        with self._checkout() as con:
+            previous = [
+                (name, con.execute("PRAGMA {};".format(name)).scalar())
+                for name, _ in settings]
+            for name, value in settings:
+                con.execute("PRAGMA {}={};".format(name, value))
+            try:
+                yield self
+            finally:
+                for name, value in reversed(previous):
+                    con.execute("PRAGMA {}={};".format(name, value))
+
+    def _bulk_load(self):
+        """Pragmas applied for the duration of load_dataframe(method="fast")."""
+        return self.pragmas("bulk_load")
+
+    def _bulk_insert(self, pd_table, conn, keys, data_iter):
+        """Insert all rows with one DBAPI ``executemany``."""
+        preparer = conn.dialect.identifier_preparer
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            preparer.format_table(pd_table.table),
+            ", ".join([preparer.quote(k) for k in keys]),
+            ", ".join(["?"] * len(keys)))
+        cursor = conn.connection.cursor()
+        try:
+            cursor.executemany(sql, data_iter)
+        finally:
+            cursor.close()
+        return
+
+    @property
+    def _concurrent_reads(self):
+        """
+        Each thread opens its own connection to an on-disk database (readers
+        don't block on writers in WAL mode). In-memory databases can only
+        be read through ``self.con``.
+        """
+        return make_url(self._url).database not in (None, "", ":memory:")
+
+    @property
+    def _cache_key(self):
+        """
+        The absolute path of the database file; relative paths name different
+        files depending on the working directory.
+        """
+        if not self._concurrent_reads:
+            return str(self._url)
+        return "sqlite:///{}".format(
+            os.path.abspath(make_url(self._url).database))
+
+    def _schema_version(self):
+        """
+        The database file and its schema cookie, which every schema change
+        increments.
+        """
+        if not self._concurrent_reads:
+            return None
+        return "{}:{}".format(
+            self._cache_key,
+            self.con.execute("PRAGMA schema_version;").scalar())
+
+    def _estimate_count(self, table_name):
+        """
+        Uses the row count that ``ANALYZE`` stores in ``sqlite_stat1``, or
+        else the largest rowid (a b-tree seek, exact unless rows were
+        deleted).
+        """
+        try:
+            stat = self.con.execute(
+                text("SELECT stat FROM sqlite_stat1 WHERE tbl = :tbl LIMIT 1"),
+                tbl=table_name).scalar()
+            if stat:
+                return int(stat.split()[0])
+        except DatabaseError:
+            # No sqlite_stat1 until the database is analyzed
+            pass
+        try:
+            return self.con.execute("SELECT max(rowid) FROM {};".format(
+                self.engine.dialect.identifier_preparer.quote(
+                    table_name))).scalar()
+        except DatabaseError:
+            # Views and WITHOUT ROWID tables
+            return None
+
     @property
     def databases(self):
         r = self.con.execute("PRAGMA database_list;")
@@ -667,10 +1577,27 @@ class SQLiteDB(DB):
         data = {"tbl": table_name, "col": column_name}
         return self.sql(s, data)
 
-    def create_table_as(self, table_name, sql, **kwargs):  # TODO: add tests
+    # Column types for the storage classes returned by typeof()
+    _storage_types = {
+        "integer": "INTEGER",
+        "real": "REAL",
+        "text": "TEXT",
+        "blob": "BLOB"
+        }
+
+    def create_table_as(self, table_name, sql, native=True, **kwargs):
         """
-        Handles ``CREATE TABLE {{table_name}} AS {{select_statement}};`` via
-        pandas to preserve column type affinity. (WIP)
+        Handles ``CREATE TABLE {{table_name}} AS {{select_statement}};``
+        while preserving the declared column types, which SQLite's own
+        ``CREATE TABLE ... AS`` reduces to their affinity (e.g. a DATETIME
+        column becomes NUM).
+
+        The SELECT is wrapped in a temporary view whose ``table_info`` gives
+        each column the declared type of the source column it reads. Columns
+        computed by expressions take the storage class of their first value.
+        The table is created with those types and filled by
+        ``INSERT INTO ... SELECT`` in one transaction; no rows pass through
+        Python.
 
         Parameters
         ----------
@@ -678,19 +1605,108 @@ class SQLiteDB(DB):
             Name of table to create
         sql: str
             SQL `SELECT` statement used to create a new table
+        native: bool
+            Create the table inside the database (default). If False, the
+            results are read into a DataFrame and written with
+            ``load_dataframe``.
+        if_exists: str
+            "fail", "replace" or "append", as in ``DataFrame.to_sql``.
+            Appended rows are inserted by column name.
+        **kwargs: dict
+            Passed to ``load_dataframe``. Options other than ``if_exists``
+            use the pandas path.
 
         Returns
         -------
         None
+
+        Example
+        -------
+        >>> d = SQLiteDB("tests/chinook.sqlite")
+        >>> d.create_table_as(
+        ...     "temp.Sales", "SELECT InvoiceDate, Total FROM Invoice")
+        >>> info = d.con.execute("PRAGMA temp.table_info(Sales)").fetchall()
+        >>> [row[2] for row in info] == ["DATETIME", "NUMERIC(10,2)"]
+        True
+        """
+        if not native or set(kwargs) - set(["if_exists"]):
+            df = self.sql(sql)
+            self.load_dataframe(df, table_name, **kwargs)
+            return
+        if_exists = kwargs.get("if_exists", "fail")
+        if if_exists not in ("fail", "replace", "append"):
+            raise AttributeError(
+                "if_exists must be 'fail', 'replace' or 'append'")
+        quote = self.engine.dialect.identifier_preparer.quote
+        schema, name = "main", table_name
+        if "." in table_name:
+            schema, name = table_name.split(".", 1)
+        target = "{}.{}".format(quote(schema), quote(name))
+        view = quote("_db2_create_table_as")
+        if self._echo:
+            print("CREATE TABLE {} AS {}".format(target, sql))
+        try:
+            with self.transaction() as con:
+                exists = con.execute(
+                    "SELECT count(*) FROM {}.sqlite_master "
+                    "WHERE type = 'table' AND name = ?;".format(quote(schema)),
+                    (name,)).scalar()
+                if exists and if_exists == "fail":
+                    raise ValueError(
+                        "Table '{}' already exists.".format(table_name))
+                if exists and if_exists == "replace":
+                    con.execute("DROP TABLE {};".format(target))
+                con.execute("CREATE TEMP VIEW {} AS {};".format(
+                    view, sql.strip().rstrip(";")))
+                columns = [(row[1], row[2]) for row in con.execute(
+                    "PRAGMA temp.table_info({});".format(view))]
+                if not exists or if_exists == "replace":
+                    self._create_typed_table(con, target, view, columns)
+                con.execute("INSERT INTO {} ({}) SELECT * FROM {};".format(
+                    target, ", ".join([quote(n) for n, _ in columns]), view))
+                con.execute("DROP VIEW {};".format(view))
+        finally:
+            self._invalidate_results(table_name)
+        return
+
+    def _create_typed_table(self, con, target, view, columns):
+        """
+        Creates a table with the (name, declared type) columns of a view.
+        Untyped columns take the storage class of their first value.
         """
-        df = self.sql(sql)
-        self.load_dataframe(df, table_name, **kwargs)
+        quote = self.engine.dialect.identifier_preparer.quote
+        types = [decl for _, decl in columns]
+        if not all(types):
+            first = con.execute("SELECT {} FROM {} LIMIT 1;".format(
+                ", ".join(["typeof({})".format(quote(name))
+                           for name, _ in columns]), view)).fetchone()
+            if first is not None:
+                types = [decl or self._storage_types.get(storage, "")
+                         for decl, storage in zip(types, first)]
+        con.execute("CREATE TABLE {} ({});".format(target, ", ".join(
+            ["{} {}".format(quote(name), decl).strip()
+             for (name, _), decl in zip(columns, types)])))
         return
 
     def __str__(self):
         return "SQLite[SQLite] > {dbname}".format(dbname=self.dbname)
 
 
+class _CopyNull(object):
+    """
+    A NULL for ``PostgresDB._copy_csv``. Like a number, csv writes it
+    unquoted with ``QUOTE_NONNUMERIC``.
+    """
+    def __float__(self):
+        return 0.0
+
+    def __str__(self):
+        return "\\N"
+
+
+_COPY_NULL = _CopyNull()
+
+
 class PostgresDB(DB):
     """
     Utility for exploring and querying a PostgreSQL database. (WIP)
@@ -698,7 +1714,7 @@ class PostgresDB(DB):
     def __init__(self, username, password, hostname, dbname, dbtype="postgres",
                  port=5432, schemas=None, profile="default", echo=False,
                  exclude_system_tables=True, limit=1000, keys_per_column=None,
-                 driver="psycopg2"):
+                 driver="psycopg2", pooled=False, pool_options=None):
         super(PostgresDB, self).__init__(
             username=username,
             password=password,
@@ -706,7 +1722,82 @@ class PostgresDB(DB):
             dbname=dbname,
             dbtype="postgres",
             driver=driver,
-            echo=echo)
+            echo=echo,
+            pooled=pooled,
+            pool_options=pool_options)
+
+    def _schema_version(self):
+        """
+        Postgres doesn't timestamp DDL, so this is a hash of the catalog
+        entries that reflection reads (table names, columns, constraints and
+        indexes).
+        """
+        return self.con.execute(
+            "SELECT current_database() || ':' || md5("
+            "coalesce((SELECT string_agg(n.nspname || '.' || c.relname || "
+            "'.' || a.attrelid || '.' || a.attnum || "
+            "a.attname || a.atttypid || '.' || a.atttypmod || a.attnotnull, "
+            "',' ORDER BY a.attrelid, a.attnum) "
+            "FROM pg_attribute a "
+            "JOIN pg_class c ON c.oid = a.attrelid "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname NOT IN ('pg_catalog', 'information_schema') "
+            "AND a.attnum > 0 AND NOT a.attisdropped), '') || "
+            "coalesce((SELECT string_agg(oid::text, ',' ORDER BY oid) "
+            "FROM pg_constraint), '') || "
+            "coalesce((SELECT string_agg(indexrelid::text, ',' "
+            "ORDER BY indexrelid) FROM pg_index), ''));").scalar()
+
+    def _estimate_count(self, table_name):
+        """The planner's row estimate, updated by ``VACUUM`` and ``ANALYZE``."""
+        count = self.con.execute(
+            text("SELECT reltuples::bigint FROM pg_class "
+                 "WHERE oid = to_regclass(:tbl);"),
+            tbl=table_name).scalar()
+        # -1 (or 0 before Postgres 14) if the table was never analyzed
+        if not count or count < 0:
+            return None
+        return count
+
+    # psycopg2 buffers whole results unless a named cursor is used
+    _server_side_cursors = True
+
+    def _tablesample(self, table, frac):
+        """Samples whole pages, so only about ``frac`` of the table is read."""
+        return table.tablesample(func.system(frac * 100))
+
+    @staticmethod
+    def _copy_csv(rows):
+        r"""
+        Writes rows as CSV for ``COPY``. Strings are quoted, so empty strings
+        (and '\N') aren't read as NULLs, which are written as an unquoted
+        ``\N``.
+
+        Example
+        -------
+        >>> print(PostgresDB._copy_csv([[1, None, ""]]).read().strip())
+        1,\N,""
+        """
+        buf = StringIO()
+        writer = csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerows([[_COPY_NULL if v is None else v for v in row]
+                          for row in rows])
+        buf.seek(0)
+        return buf
+
+    def _bulk_insert(self, pd_table, conn, keys, data_iter):
+        """Stream the rows to ``COPY ... FROM STDIN`` as CSV."""
+        buf = self._copy_csv(data_iter)
+        preparer = conn.dialect.identifier_preparer
+        sql = "COPY {} ({}) FROM STDIN WITH CSV NULL '\\N'".format(
+            preparer.format_table(pd_table.table),
+            ", ".join([preparer.quote(k) for k in keys]))
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(sql, buf)
+        finally:
+            cursor.close()
+        return
 
 
 class MSSQLDB(DB):
@@ -714,7 +1805,8 @@ class MSSQLDB(DB):
     Utility for exploring and querying a Microsoft SQL database. (WIP)
     """
     def __init__(self, username, password, hostname, dbname, schema_name="dbo",
-                 port=1433, driver='pymssql', profile=None, echo=False):
+                 port=1433, driver='pymssql', profile=None, echo=False,
+                 pooled=False, pool_options=None):
 
         self.schema_name = schema_name
         super(MSSQLDB, self).__init__(
@@ -724,12 +1816,63 @@ class MSSQLDB(DB):
             dbname=dbname,
             dbtype="mssql",
             driver=driver,
-            echo=echo)
+            echo=echo,
+            pooled=pooled,
+            pool_options=pool_options)
 
         # Uh, doing this twice actually prevents a ProgrammingError... weird.
         self.sql("USE {{dbname}};", {"dbname": dbname})
         self.sql("USE {{dbname}};", {"dbname": dbname})
 
+    def _on_connect(self, conn, _):
+        """Select the database on each new connection from the pool."""
+        cursor = conn.cursor()
+        cursor.execute("USE [{}];".format(self.credentials["dbname"]))
+        cursor.close()
+        return
+
+    def _schema_version(self):
+        """
+        The database name, latest object modification time and the number of
+        objects.
+        """
+        return self.con.execute(
+            "SELECT DB_NAME() + ':' + "
+            "CONVERT(VARCHAR(33), MAX(modify_date), 126) + '/' + "
+            "CAST(COUNT(*) AS VARCHAR(12)) "
+            "FROM sys.objects WHERE is_ms_shipped = 0;").scalar()
+
+    def _estimate_count(self, table_name):
+        """Row count of the heap or clustered index from ``sys.partitions``."""
+        return self.con.execute(
+            text("SELECT SUM(rows) FROM sys.partitions "
+                 "WHERE object_id = OBJECT_ID(:tbl) AND index_id IN (0, 1);"),
+            tbl=table_name).scalar()
+
+    def _random(self):
+        return func.newid()
+
+    def _unordered(self):
+        """SQL Server requires an ORDER BY with OFFSET."""
+        return literal_column("(SELECT NULL)")
+
+    # SQLAlchemy ignores stream_results for drivers without server-side
+    # cursors; pymssql reads rows from the connection as they are fetched
+    _server_side_cursors = True
+
+    # SQL Server allows 2100 parameters per statement and 1000 VALUES rows
+    _max_parameters = 2100
+    _max_values_rows = 1000
+
+    def _bulk_insert(self, pd_table, conn, keys, data_iter):
+        """Insert batches of rows as multi-row ``INSERT ... VALUES``."""
+        batch_size = max(1, min(self._max_values_rows,
+                                (self._max_parameters - 1) // len(keys)))
+        for batch in utils.chunks(data_iter, batch_size):
+            conn.execute(pd_table.table.insert().values(
+                [dict(zip(keys, row)) for row in batch]))
+        return
+
     @property
     def table_names(self):
         raw_names = self.sql(
@@ -0,0 +1,654 @@
+# !/usr/bin/env python2
+"""
+Pipelines that stream query results from readers to a single writer thread,
+and the table exports and copies built on them.
+"""
+
+from __future__ import unicode_literals
+
+import copy
+import io
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import pandas as pd
+from sqlalchemy import Column, MetaData, String, Table
+from sqlalchemy.exc import CompileError
+
+import db2
+
+
+__all__ = [
+    "pipe",
+    "export_tables",
+    "copy_table",
+    "copy_query",
+    "portable_type",
+    "CopyProgress",
+    "ExcelTableWriter",
+    "CSVTableWriter",
+    "JSONLinesTableWriter",
+    "ParquetTableWriter"
+    ]
+
+
+# =============================================================================
+# Pipeline
+# =============================================================================
+
+class _Aborted(Exception):
+    """Raised in readers when the pipeline stops because of an error."""
+    pass
+
+
+_DONE = object()
+
+
+@contextmanager
+def _nothing():
+    yield
+
+
+def pipe(readers, write, max_workers=1, queue_size=None, context=None):
+    """
+    Sends the items produced by ``readers`` through a bounded queue to
+    ``write``, which runs on a single writer thread. Reading and writing
+    overlap, and at most ``queue_size`` items are held in memory. An error in
+    a reader or the writer stops the pipeline and is raised.
+
+    Parameters
+    ----------
+    readers: list
+        Functions (called without arguments) that return iterables of items.
+    write: function
+        Called as ``write(i, item)`` for each item of ``readers[i]``, in the
+        order each reader produced them.
+    max_workers: int
+        Number of readers to run at once on a pool of threads. With 1, the
+        readers run one after another on the calling thread.
+    queue_size: int
+        Maximum number of items waiting to be written (default:
+        ``db2.options["pipeline_queue_size"]``).
+    context: function
+        Returns a context manager that the writer thread enters before the
+        first item and exits after the last (e.g. to hold a connection).
+
+    Example
+    -------
+    >>> from db2.pipeline import pipe
+    >>> out = []
+    >>> pipe([lambda: range(3), lambda: "ab"],
+    ...      lambda i, item: out.append((i, item)))
+    >>> [str(i) for _, i in out]
+    ['0', '1', '2', 'a', 'b']
+    """
+    if queue_size is None:
+        queue_size = db2.options["pipeline_queue_size"]
+    items = queue.Queue(queue_size)
+    abort = threading.Event()
+    errors = []
+
+    def put(item):
+        while not abort.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _Aborted()
+
+    def writer():
+        try:
+            with (context or _nothing)():
+                while not abort.is_set():
+                    try:
+                        item = items.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if item is _DONE:
+                        return
+                    write(*item)
+        except Exception as e:
+            errors.append(e)
+            abort.set()
+
+    def read(i):
+        try:
+            for item in readers[i]():
+                put((i, item))
+        except _Aborted:
+            return
+        except Exception:
+            abort.set()
+            raise
+
+    thread = threading.Thread(target=writer)
+    thread.daemon = True
+    thread.start()
+    try:
+        if max_workers <= 1 or len(readers) <= 1:
+            for i in range(len(readers)):
+                read(i)
+        else:
+            pool = ThreadPool(min(max_workers, len(readers)))
+            try:
+                pool.map(read, range(len(readers)))
+            finally:
+                pool.close()
+                pool.join()
+        put(_DONE)
+    except _Aborted:
+        pass
+    except BaseException:
+        abort.set()
+        raise
+    finally:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return
+
+
+# =============================================================================
+# Table Writers
+# =============================================================================
+
+class TableWriter(object):
+    """
+    Writes tables to an export format one chunk (DataFrame) at a time.
+
+    Parameters
+    ----------
+    path: str
+        Output file, or directory for formats with one file per table.
+    names: list
+        Output name (e.g. sheet or file name) of each table.
+    index: bool
+        Write a row number column, continued across chunks.
+    header: bool
+        Write the column names.
+    """
+    extension = None
+
+    def __init__(self, path, names, index=False, header=True):
+        self.path = path
+        self.names = names
+        self.index = index
+        self.header = header
+        self.rows = [0] * len(names)
+
+    def output(self, i):
+        """Returns the path that table ``i`` is written to."""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        return os.path.join(
+            self.path, "{}.{}".format(self.names[i], self.extension))
+
+    def _frame(self, i, df):
+        """Adds the row number column, if requested."""
+        if self.index:
+            df = df.copy()
+            df.insert(0, "", range(self.rows[i], self.rows[i] + len(df)))
+        return df
+
+    def write(self, i, df):
+        """Writes a chunk of table ``i``."""
+        first = self.rows[i] == 0
+        self._write(i, self._frame(i, df), first)
+        self.rows[i] += len(df)
+        return
+
+    def _write(self, i, df, first):
+        raise NotImplementedError(
+            'This is an abstract method intended to be overwritten')
+
+    def close(self):
+        """Finishes writing."""
+        return
+
+
+class ExcelTableWriter(TableWriter):
+    """
+    Writes each table to a sheet of an Excel workbook with xlsxwriter's
+    ``constant_memory`` mode, which flushes each row to disk once it's
+    written instead of keeping the workbook in memory.
+
+    Parameters
+    ----------
+    na_rep: str
+        Value written for NULLs (default: empty cells).
+    float_format: str
+        Format string that floats are rounded with (e.g. "%.2f"), as in
+        ``DataFrame.to_excel``.
+    freeze_panes: tuple
+        The (row, column) to freeze each sheet at.
+    """
+    extension = "xlsx"
+    # Rows in an Excel sheet
+    max_rows = 1048576
+
+    def __init__(self, path, names, index=False, header=True, na_rep="",
+                 float_format=None, freeze_panes=None):
+        import xlsxwriter
+        super(ExcelTableWriter, self).__init__(path, names, index, header)
+        self.na_rep = na_rep or None
+        self.float_format = float_format
+        self.workbook = xlsxwriter.Workbook(path, {
+            "constant_memory": True,
+            "default_date_format": "yyyy-mm-dd hh:mm:ss",
+            "remove_timezone": True
+            })
+        # Sheets are created up front to keep the table order
+        self.sheets = [self.workbook.add_worksheet(name) for name in names]
+        if freeze_panes:
+            for sheet in self.sheets:
+                sheet.freeze_panes(*freeze_panes)
+        self.lines = [0] * len(names)
+
+    def output(self, i):
+        return self.path
+
+    def _write(self, i, df, first):
+        sheet = self.sheets[i]
+        if first and self.header:
+            sheet.write_row(self.lines[i], 0, [str(c) for c in df.columns])
+            self.lines[i] += 1
+        if self.lines[i] + len(df) > self.max_rows:
+            raise ValueError("table is too large for an Excel sheet: {}".format(
+                self.names[i]))
+        # Python values, with None for NULLs (written as blank cells)
+        values = df.astype(object).where(df.notnull(), self.na_rep)
+        if self.float_format:
+            for n, dtype in enumerate(df.dtypes):
+                if dtype.kind == "f":
+                    values.iloc[:, n] = [
+                        self.na_rep if pd.isnull(v)
+                        else float(self.float_format % v)
+                        for v in df.iloc[:, n]]
+        for row in values.values.tolist():
+            sheet.write_row(self.lines[i], 0, row)
+            self.lines[i] += 1
+        return
+
+    def close(self):
+        self.workbook.close()
+        return
+
+
+class CSVTableWriter(TableWriter):
+    """Writes each table to ``<path>/<name>.csv``."""
+    extension = "csv"
+
+    def _write(self, i, df, first):
+        with io.open(self.output(i), "w" if first else "a",
+                     encoding="utf-8", newline="") as f:
+            df.to_csv(f, header=first and self.header, index=False)
+        return
+
+
+class JSONLinesTableWriter(TableWriter):
+    """Writes each table to ``<path>/<name>.jsonl``, one object per row."""
+    extension = "jsonl"
+
+    def _write(self, i, df, first):
+        lines = df.to_json(orient="records", lines=True, date_format="iso")
+        with io.open(self.output(i), "w" if first else "a",
+                     encoding="utf-8", newline="") as f:
+            if len(df):
+                f.write(lines.rstrip("\n") + "\n")
+        return
+
+
+class ParquetTableWriter(TableWriter):
+    """
+    Writes each table to ``<path>/<name>.parquet``, one row group per chunk
+    (requires pyarrow).
+    """
+    extension = "parquet"
+
+    def __init__(self, path, names, index=False, header=True):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("exporting to Parquet requires pyarrow")
+        super(ParquetTableWriter, self).__init__(path, names, index, header)
+        self._pa = pyarrow
+        self.writers = [None] * len(names)
+
+    def _write(self, i, df, first):
+        pa = self._pa
+        if self.writers[i] is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self.writers[i] = pa.parquet.ParquetWriter(
+                self.output(i), table.schema)
+        else:
+            # Later chunks must match the first chunk's schema
+            table = pa.Table.from_pandas(
+                df, schema=self.writers[i].schema, preserve_index=False)
+        self.writers[i].write_table(table)
+        return
+
+    def close(self):
+        for writer in self.writers:
+            if writer is not None:
+                writer.close()
+        return
+
+
+# Export formats by name (and file extension)
+writers = {
+    "xlsx": ExcelTableWriter,
+    "csv": CSVTableWriter,
+    "jsonl": JSONLinesTableWriter,
+    "parquet": ParquetTableWriter
+    }
+
+
+# =============================================================================
+# Export
+# =============================================================================
+
+def export_tables(d, tables, path, file_format=None, where_clauses=None,
+                  strip_regex=None, chunksize=None, max_workers=1, **kwargs):
+    """
+    Streams tables from a database to an export format. Tables are read in
+    chunks (in parallel with ``max_workers`` > 1, where the database allows
+    it) while a single writer thread writes them out.
+
+    Parameters
+    ----------
+    d: DB
+        The database to export from.
+    tables: list
+        Names of the tables to export.
+    path: str
+        Output workbook for "xlsx", or the directory to write one file per
+        table to for other formats.
+    file_format: str
+        "xlsx", "csv", "jsonl" or "parquet" (default: from the extension of
+        ``path``).
+    where_clauses: list
+        A 'WHERE <clause>' or '' for each table.
+    strip_regex: str
+        A regular expression removed from table names to make output names.
+    chunksize: int
+        Rows to read at a time (default: ``db2.options["chunksize"]``).
+    max_workers: int
+        Number of tables to read at once.
+    **kwargs:
+        Passed to the format's writer (e.g. ``index``, ``header``).
+
+    Returns
+    -------
+    DataFrame:
+        The output path, row count and seconds taken for each table.
+    """
+    if file_format is None:
+        file_format = os.path.splitext(str(path))[1].lstrip(".").lower()
+    if file_format not in writers:
+        raise AttributeError("unsupported export format '{}'".format(
+            file_format))
+    if not where_clauses:
+        where_clauses = [""] * len(tables)
+    if not chunksize:
+        chunksize = db2.options["chunksize"]
+    names = list(tables)
+    if strip_regex:
+        names = [re.sub(strip_regex, "", name) for name in names]
+    writer = writers[file_format](path, names, **kwargs)
+
+    # Tables read on the calling thread share its connection
+    force = d._concurrent_reads
+    if not force:
+        max_workers = 1
+    start = time.time()
+    seconds = [None] * len(names)
+
+    def reader(tbl, where):
+        def read():
+            with d._checkout(force=force):
+                # Triple braces: the clause must not be HTML-escaped
+                for df in d.iter_sql("SELECT * FROM {{ tbl }} {{{ where }}}",
+                                     {"tbl": tbl, "where": where},
+                                     chunksize=chunksize):
+                    yield df
+        return read
+
+    def write(i, df):
+        writer.write(i, df)
+        seconds[i] = time.time() - start
+
+    try:
+        pipe([reader(tbl, where) for tbl, where in zip(tables, where_clauses)],
+             write, max_workers)
+    finally:
+        writer.close()
+    return pd.DataFrame(
+        [[tbl, writer.output(i), writer.rows[i], seconds[i]]
+         for i, tbl in enumerate(tables)],
+        columns=["Table", "Output", "Rows", "Seconds"])
+
+
+# =============================================================================
+# Copy
+# =============================================================================
+
+# Reported after each chunk written by copy_table and copy_query
+CopyProgress = namedtuple(
+    "CopyProgress", ["rows", "total_rows", "seconds", "rows_per_sec", "eta"])
+
+
+def portable_type(sa_type, dialect):
+    """
+    Returns a reflected SQLAlchemy type that another database's dialect can
+    create: the type itself, else its generic SQLAlchemy type (e.g.
+    ``DATETIME2`` -> ``DateTime``), else ``String``. Collations are dropped.
+
+    Example
+    -------
+    >>> from sqlalchemy.dialects import mssql, sqlite
+    >>> portable_type(mssql.DATETIME2(), sqlite.dialect())
+    DateTime()
+    """
+    if getattr(sa_type, "collation", None):
+        sa_type = copy.copy(sa_type)
+        sa_type.collation = None
+    candidates = [sa_type]
+    try:
+        candidates.append(sa_type.as_generic())
+    except (AttributeError, NotImplementedError):
+        pass
+    for candidate in candidates:
+        try:
+            candidate.compile(dialect=dialect)
+            return candidate
+        except CompileError:
+            continue
+    return String()
+
+
+def _copy(src, dst, sql, data, target_name, if_exists, dtype, total_rows,
+          chunksize, progress):
+    """
+    Streams the results of ``sql`` from ``src`` into ``dst.target_name``.
+    The first chunk is written with ``if_exists`` and ``dtype`` (see
+    ``DataFrame.to_sql``), so it creates the table unless it already exists.
+    """
+    if not chunksize:
+        chunksize = db2.options["chunksize"]
+    start = time.time()
+    status = {"rows": 0, "if_exists": if_exists}
+
+    def read():
+        with src._checkout(force=src._concurrent_reads):
+            for df in src.iter_sql(sql, data, chunksize=chunksize):
+                yield df
+
+    @contextmanager
+    def session():
+        # The writer holds one connection (and bulk load settings) throughout
+        with dst._checkout(force=dst._concurrent_reads), dst._bulk_load():
+            yield
+
+    def write(i, df):
+        types = None
+        if dtype:
+            types = dict((c, dtype[c]) for c in df.columns if c in dtype)
+        with dst.transaction():
+            df.to_sql(target_name, dst.con, if_exists=status["if_exists"],
+                      index=False, dtype=types or None,
+                      method=dst._bulk_insert)
+        status["if_exists"] = "append"
+        status["rows"] += len(df)
+        rows = status["rows"]
+        seconds = time.time() - start
+        rate = rows / seconds if seconds else float(rows)
+        eta = None
+        if total_rows is not None and rate:
+            eta = max(total_rows - rows, 0) / rate
+        report = CopyProgress(rows, total_rows, seconds, rate, eta)
+        if progress:
+            progress(report)
+        if src._echo or dst._echo:
+            print("{}: {} of {} rows ({:,.0f} rows/sec, ETA {})".format(
+                target_name, rows, "?" if total_rows is None else total_rows,
+                rate, "?" if eta is None else "{:.1f}s".format(eta)))
+
+    try:
+        if dst._concurrent_reads:
+            pipe([read], write, context=session)
+        else:
+            # In-memory targets can only be written on the calling thread,
+            # so reads and writes take turns
+            with session():
+                for df in read():
+                    write(0, df)
+    finally:
+        dst._invalidate_results(target_name)
+    seconds = time.time() - start
+    rows = status["rows"]
+    return {
+        "table": target_name,
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds else float(rows)
+        }
+
+
+def copy_table(src, dst, table_name, target_name=None, if_exists="fail",
+               chunksize=None, progress=None):
+    """
+    Copies a table from one database to another. Chunks read from ``src``
+    are bulk loaded into ``dst`` by a writer thread with its own connection,
+    so the source is read while the target is written.
+
+    The target table is created from the table's reflected schema: column
+    names, primary key and nullability are kept, and types that the target
+    database doesn't have are mapped to their generic SQLAlchemy types (see
+    ``portable_type``).
+
+    Parameters
+    ----------
+    src: DB
+        The database to copy from.
+    dst: DB
+        The database to copy to.
+    table_name: str
+        Name of the table to copy.
+    target_name: str
+        Name of the new table (default: ``table_name`` without its schema).
+    if_exists: str
+        "fail", "replace" or "append", as in ``DataFrame.to_sql``.
+    chunksize: int
+        Rows to read and write at a time (default:
+        ``db2.options["chunksize"]``).
+    progress: function
+        Called with a ``CopyProgress(rows, total_rows, seconds, rows_per_sec,
+        eta)`` after each chunk is written. ``total_rows`` (and so the ETA in
+        seconds) comes from the table's estimated row count. Progress is
+        also printed if either DB was created with ``echo=True``.
+
+    Returns
+    -------
+    dict:
+        The target table name, number of rows, seconds elapsed and rows per
+        second.
+    """
+    if if_exists not in ("fail", "replace", "append"):
+        raise AttributeError("if_exists must be 'fail', 'replace' or 'append'")
+    try:
+        table_schema = getattr(src.schema, table_name.split(".")[-1])
+    except AttributeError:
+        raise AttributeError("table not found: {}".format(table_name))
+    table = table_schema.Table
+    if target_name is None:
+        target_name = table.name
+    dialect = dst.engine.dialect
+    target = Table(target_name, MetaData(), *[
+        Column(c.name, portable_type(c.type, dialect), nullable=c.nullable,
+               primary_key=c.primary_key, autoincrement=False)
+        for c in table.columns])
+
+    exists = dst.engine.has_table(target_name)
+    if exists and if_exists == "fail":
+        raise ValueError("Table '{}' already exists.".format(target_name))
+    if not exists or if_exists == "replace":
+        with dst.transaction() as con:
+            if exists:
+                target.drop(con)
+            target.create(con)
+    sql = "SELECT * FROM {}".format(
+        src.engine.dialect.identifier_preparer.format_table(table))
+    return _copy(src, dst, sql, None, target_name, "append", None,
+                 table_schema.count(estimate=True), chunksize, progress)
+
+
+def copy_query(src, dst, sql, target_name, data=None, if_exists="fail",
+               chunksize=None, progress=None):
+    """
+    Copies the results of a query from one database into a table of another,
+    streaming them like ``copy_table``. Result columns named like the
+    columns of already reflected ``src.schema`` tables get those columns'
+    types (see ``portable_type``); pandas infers the others.
+
+    Parameters
+    ----------
+    src: DB
+        The database to query.
+    dst: DB
+        The database to copy to.
+    sql: str
+        A SELECT statement (see ``DB.sql``).
+    target_name: str
+        Name of the table to write to.
+    data: dict, tuple
+        Variables to pass to placeholders in the SQL.
+    if_exists, chunksize, progress:
+        See ``copy_table``. The total row count is unknown.
+
+    Returns
+    -------
+    dict:
+        The target table name, number of rows, seconds elapsed and rows per
+        second.
+    """
+    if if_exists not in ("fail", "replace", "append"):
+        raise AttributeError("if_exists must be 'fail', 'replace' or 'append'")
+    dtype = {}
+    # Only use what has been reflected already
+    if "meta" in src.schema.__dict__:
+        dialect = dst.engine.dialect
+        dtype = dict((name, portable_type(sa_type, dialect)) for name, sa_type
+                     in src.schema._column_type_map().items())
+    return _copy(src, dst, sql, data, target_name, if_exists, dtype, None,
+                 chunksize, progress)
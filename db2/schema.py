@@ -3,9 +3,15 @@
 Classes for interactively exploring tables.
 """
 
+import hashlib
+import os
+import pickle
+
 import pandas as pd
-from sqlalchemy import select, func, MetaData
+from sqlalchemy import (select, func, distinct, literal_column, MetaData,
+                        Table, Boolean, LargeBinary)
 
+import db2
 from .utils import df_to_prettytable
 
 
@@ -17,6 +23,8 @@ class TableSchema(object):
         """Provides an at-a-glace description of a table."""
         self.name = table_name
         self._d = database
+        self._count = None
+        self._profiles = {}
 
     @property
     def Table(self):
@@ -26,36 +34,153 @@ class TableSchema(object):
     @property
     def table_schema(self):
         cols = ["Column", "Type", "Foreign Key", "Reference Keys"]
-        schema = pd.DataFrame([], columns=cols)
-        ref = self._d.schema.foreign_keys()
-
+        references = self._d.schema._references
+        rows = []
         for column in self.Table.columns:
             fkeys = list(column.foreign_keys)
             for_key = ""
             if fkeys:
                 for_key = fkeys[0].target_fullname
+            ref_keys = ", ".join(references(self.name, column.name))
+            rows.append([column.name, column.type, for_key, ref_keys])
+        return pd.DataFrame(rows, columns=cols)
+
+    def _read(self, s):
+        """Returns the results of a select statement as a DataFrame."""
+        rprox = self._d.con.execute(s)
+        return pd.DataFrame(rprox.fetchall(), columns=rprox.keys())
+
+    def all(self):
+        """Returns the entire table as a DataFrame."""
+        return self._read(self.Table.select())
+
+    def head(self, n=None):
+        """
+        Returns the first ``n`` rows of the table (default: the database's
+        ``_max_return_rows``). Only ``n`` rows are read.
+        """
+        if n is None:
+            n = self._d._max_return_rows
+        return self._read(self.Table.select().limit(n))
+
+    def tail(self, n=None):
+        """
+        Returns the last ``n`` rows of the table by primary key (default: the
+        database's ``_max_return_rows``). Tables without a primary key are
+        read past the first ``count() - n`` rows.
+        """
+        if n is None:
+            n = self._d._max_return_rows
+        pkey = list(self.Table.primary_key.columns)
+        if pkey:
+            s = self.Table.select().order_by(
+                *[c.desc() for c in pkey]).limit(n)
+            return self._read(s).iloc[::-1].reset_index(drop=True)
+        s = self.Table.select()
+        if self._d._unordered() is not None:
+            s = s.order_by(self._d._unordered())
+        return self._read(s.offset(max(self.count() - n, 0)).limit(n))
+
+    def sample(self, n=None, frac=None):
+        """
+        Returns a random sample of ``n`` rows (default: the database's
+        ``_max_return_rows``) or of about ``frac`` of the table's rows.
+
+        Parameters
+        ----------
+        n: int
+            Number of rows to return.
+        frac: float
+            Fraction of rows to return, between 0 and 1. Uses the database's
+            ``TABLESAMPLE`` where available, otherwise samples
+            ``frac * count(estimate=True)`` rows.
+        """
+        return self._read(self._sample(n, frac))
 
-            try:
-                ref_keys = ", ".join(
-                    ref[(ref["Foreign Table"] == self.name)
-                        & (ref["Column"] == column.name)].apply(
-                        lambda x: ".".join(x[["Table", "Column"]]),
-                        axis=1).tolist())
-            except AttributeError:
-                ref_keys = ""
-
-            # print("{} {} {}".format(column.name, column.type, fkey))
-            row = pd.DataFrame([
-                [column.name,
-                 column.type,
-                 for_key,
-                 ref_keys]],
-                columns=cols)
-            schema = schema.append(row)
-        return schema.reset_index(drop=True)
-
-    def head(self):
-        return self.all().head()
+    def _sample(self, n=None, frac=None):
+        """Returns a selectable for ``sample(n, frac)``."""
+        if n is not None and frac is not None:
+            raise AttributeError("use either 'n' or 'frac', not both")
+        if frac is not None:
+            if not 0 <= frac <= 1:
+                raise AttributeError("'frac' must be between 0 and 1")
+            sampled = self._d._tablesample(self.Table, frac)
+            if sampled is not None:
+                return sampled.select()
+            n = int(round(frac * self.count(estimate=True)))
+        if n is None:
+            n = self._d._max_return_rows
+        return self.Table.select().order_by(self._d._random()).limit(n)
+
+    def profile(self, n=None, frac=None, top=0):
+        """
+        Returns statistics for each column: the number of values, NULLs and
+        distinct values, and the minimum and maximum. All columns are
+        profiled by a single aggregate query, so the table is scanned once.
+        Profiles are cached until the schema is refreshed.
+
+        Parameters
+        ----------
+        n: int
+            Profile a random sample of ``n`` rows (see ``sample``) instead of
+            the whole table.
+        frac: float
+            Profile a sample of about ``frac`` of the table's rows.
+        top: int
+            Also list the ``top`` most common values of each column. This
+            runs one grouped query per column.
+
+        Returns
+        -------
+        DataFrame:
+            One row per column, with its 'Column', 'Type', 'Count', 'Nulls',
+            'Distinct', 'Min' and 'Max' (and 'Top' values).
+        """
+        key = (n, frac, top)
+        if key in self._profiles:
+            return self._profiles[key]
+        source = self.Table
+        if n is not None or frac is not None:
+            source = self._sample(n, frac).alias("sampled")
+        columns = list(source.columns)
+        aggregates = [func.count().label("row_count")]
+        for i, column in enumerate(columns):
+            # Binary and boolean columns can't be compared everywhere
+            comparable = not isinstance(column.type, (LargeBinary, Boolean))
+            nothing = literal_column("NULL")
+            aggregates.extend([
+                func.count(column).label("count_{}".format(i)),
+                (func.count(distinct(column))
+                 if not isinstance(column.type, LargeBinary)
+                 else nothing).label("distinct_{}".format(i)),
+                (func.min(column) if comparable else nothing).label(
+                    "min_{}".format(i)),
+                (func.max(column) if comparable else nothing).label(
+                    "max_{}".format(i))
+                ])
+        row = self._d.con.execute(
+            select(aggregates).select_from(source)).fetchone()
+        total = row[0]
+        rows = []
+        for i, column in enumerate(columns):
+            count, n_distinct, min_value, max_value = row[1 + 4 * i:5 + 4 * i]
+            rows.append([column.name, column.type, count, total - count,
+                         n_distinct, min_value, max_value])
+        cols = ["Column", "Type", "Count", "Nulls", "Distinct", "Min", "Max"]
+        df = pd.DataFrame(rows, columns=cols)
+        if top:
+            df["Top"] = [self._top_values(source, column, top)
+                         for column in columns]
+        self._profiles[key] = df
+        return df
+
+    def _top_values(self, source, column, top):
+        """Returns the ``top`` most common non-NULL values of a column."""
+        frequency = func.count().label("frequency")
+        s = (select([column, frequency]).select_from(source)
+             .where(column.isnot(None)).group_by(column)
+             .order_by(frequency.desc(), column).limit(top))
+        return [r[0] for r in self._d.con.execute(s)]
 
     def pretty(self):
         print(self.__str__())
@@ -65,14 +190,35 @@ class TableSchema(object):
     def columns(self):
         return [c.name for c in self.Table.columns]
 
-    @property
-    def count(self):
-        s = select([func.count()]).select_from(self.Table)
-        s.bind = self._d.engine
-        return s.execute().fetchone()[0]
+    def count(self, estimate=False):
+        """
+        Returns the number of rows in the table. Exact counts are cached until
+        the schema is refreshed.
+
+        Parameters
+        ----------
+        estimate: bool
+            Return the row count from the database's statistics (or the cached
+            exact count) instead of scanning the table. Falls back to an exact
+            count if the database has no estimate.
+        """
+        if self._count is None and estimate:
+            rowcnt = self._d._estimate_count(self.name)
+            if rowcnt is not None:
+                return rowcnt
+        if self._count is None:
+            s = select([func.count()]).select_from(self.Table)
+            s.bind = self._d.engine
+            self._count = s.execute().fetchone()[0]
+        return self._count
 
     def __repr__(self):
         r = "<TableSchema for {tbl}: {rowcnt} Rows, {colcnt} Columns: {cols}>"
+        # Never scan the table just to display it
+        rowcnt = self._count
+        if rowcnt is None:
+            rowcnt = self._d._estimate_count(self.name)
+            rowcnt = "?" if rowcnt is None else "~{}".format(rowcnt)
         col_cnt = len(self.columns)
         columns = self.columns
         if col_cnt > 5:
@@ -80,7 +226,7 @@ class TableSchema(object):
             columns.extend(["..."])
         return r.format(
             tbl=self.name,
-            rowcnt=self.count,
+            rowcnt=rowcnt,
             colcnt=col_cnt,
             cols=columns)
 
@@ -98,47 +244,253 @@ class Schema(object):  # TODO: use Inspector class and refactor
         # TODO: super(Schema, self).__init__(self, database.engine)
         self._d = database
         self._loaded = False
+        self._table_names = None
+        self._fk_rows = None
+        self._column_types = None
+        self._fk_index = None
+        self._snapshot_checked = False
 
-    def refresh(self):
-        """Refreshes the schema."""
+    @property
+    def _names(self):
+        """Maps attribute names to table names (cached until refreshed)."""
+        if self._table_names is None:
+            names = {}
+            for table_name in self._d.table_names:
+                attr_name = table_name
+                # Handle MSSQL names (e.g. 'dbo.MyTable' -> 'MyTable')
+                if "." in table_name:
+                    attr_name = table_name.split(".")[1]
+                names[attr_name] = table_name
+            self._table_names = names
+        return self._table_names
+
+    # =========================================================================
+    # Snapshot cache
+    # =========================================================================
+
+    @property
+    def _snapshot_path(self):
+        """Cache file for this database, keyed by ``DB._cache_key``."""
+        key = hashlib.sha1(self._d._cache_key.encode("utf8")).hexdigest()
+        return os.path.join(db2.options["schema_cache_dir"],
+                            "{}.pickle".format(key))
+
+    def _load_snapshot(self):
+        """
+        Loads the reflected tables from the snapshot cache if it is enabled
+        and the snapshot matches the database's current schema version.
+        Returns True if the snapshot was used.
+        """
+        self._snapshot_checked = True
+        if not db2.options["schema_cache"]:
+            return False
+        path = self._snapshot_path
+        if not os.path.exists(path):
+            return False
+        version = self._d._schema_version()
+        if version is None:
+            return False
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+        except Exception:
+            # Unreadable or written by an incompatible SQLAlchemy: re-reflect
+            return False
+        if snapshot.get("version") != version:
+            return False
+        self.meta = snapshot["meta"]
+        self.meta.bind = self._d.engine
+        self._table_names = snapshot["table_names"]
+        self._fk_rows = None
+        self._column_types = None
+        for table_name in self.meta.tables:
+            setattr(self, table_name.split(".")[-1],
+                    TableSchema(self._d, table_name))
+        self._loaded = True
+        return True
+
+    def _save_snapshot(self):
+        """Writes the fully reflected schema to the snapshot cache."""
+        if not db2.options["schema_cache"]:
+            return
+        version = self._d._schema_version()
+        if version is None:
+            return
+        path = self._snapshot_path
+        snapshot = {
+            "version": version,
+            "table_names": self._names,
+            "meta": self.meta
+            }
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # Write then rename so readers never see a partial file
+            tmp_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            # The cache is an optimization; reflection already succeeded
+            pass
+        return
+
+    # =========================================================================
+    # Reflection
+    # =========================================================================
+
+    def _reflect(self, table_names, resolve_fks=False):
+        """
+        Reflects only the given tables (replacing any previously reflected
+        versions) and creates their TableSchema attributes.
+        """
+        if "meta" not in self.__dict__:
+            self.meta = MetaData(bind=self._d.engine)
+        self._fk_rows = None
+        self._column_types = None
+        schema = self._d.schema_name if self._d.dbtype == "mssql" else None
+        for table_name in table_names:
+            if table_name in self.meta.tables:
+                self.meta.remove(self.meta.tables[table_name])
+            Table(table_name.split(".")[-1] if schema else table_name,
+                  self.meta, autoload=True, autoload_with=self._d.engine,
+                  schema=schema, resolve_fks=resolve_fks)
+        # Includes any foreign key targets that were reflected
+        for table_name in self.meta.tables:
+            attr_name = table_name.split(".")[-1]
+            if table_name in table_names or attr_name not in self.__dict__:
+                setattr(self, attr_name, TableSchema(self._d, table_name))
+        self._loaded = True
+        return
+
+    def refresh(self, tables=None, resolve_fks=False, force=False):
+        """
+        Refreshes the schema. Without ``tables``, the whole database is
+        reflected; otherwise only the listed tables are.
+
+        When ``db2.options["schema_cache"]`` is set, a full refresh loads the
+        on-disk snapshot of the schema if the database hasn't changed since
+        it was written, and saves a new snapshot otherwise.
+
+        Parameters
+        ----------
+        tables: list
+            Names of tables to (re)reflect.
+        resolve_fks: bool
+            Also reflect the tables that ``tables`` reference with foreign
+            keys.
+        force: bool
+            Reflect the whole database even if the snapshot is valid (and
+            save a new snapshot).
+        """
+        self._table_names = None
+        if tables is not None:
+            names = []
+            for name in tables:
+                table_name = self._names.get(name.split(".")[-1])
+                if table_name is None:
+                    raise AttributeError(
+                        "table '{}' does not exist".format(name))
+                names.append(table_name)
+            return self._reflect(names, resolve_fks)
+
+        if not force and self._load_snapshot():
+            return
         if self._d._echo:
-            print("Loading {} tables...".format(len(self._d.table_names)))
+            print("Loading {} tables...".format(len(self._names)))
         # Set/Reset MetaData
         self.meta = MetaData(bind=self._d.engine)
+        self._fk_rows = None
+        self._column_types = None
         if self._d.dbtype == "mssql":
             #self.meta.schema = "dbo"
             self.meta.reflect(bind=self._d.engine, schema=self._d.schema_name)
         else:
             self.meta.reflect(bind=self._d.engine)
 
-        for table_name in self._d.table_names:
-            attr_name = table_name
-            # Handle MSSQL names (e.g. 'dbo.MyTable' -> 'MyTable')
-            if "." in table_name:
-                attr_name = table_name.split(".")[1]
+        for attr_name, table_name in self._names.items():
             setattr(self, attr_name, TableSchema(self._d, table_name))
         if not self._loaded:
             self._loaded = True
+        self._save_snapshot()
         return
 
+    def _foreign_key_rows(self):
+        """
+        Returns a list of [table, column, foreign table, foreign key] rows for
+        the reflected tables. The rows, and an index of the columns that
+        reference each (foreign table, foreign key), are built once per
+        refresh.
+        """
+        if self._fk_rows is None:
+            rows = []
+            index = {}
+            for table_name, tbl in sorted(self.meta.tables.items()):
+                for const in tbl.foreign_key_constraints:
+                    for fk in const.elements:
+                        # MSSQL targets are qualified (e.g. 'dbo.Table.Col')
+                        f_table, f_col = fk.target_fullname.rsplit(".", 1)
+                        rows.append([table_name, fk.parent.name, f_table,
+                                     f_col])
+                        index.setdefault((f_table, f_col), []).append(
+                            "{}.{}".format(table_name, fk.parent.name))
+            self._fk_rows = rows
+            self._fk_index = index
+        return self._fk_rows
+
+    def _references(self, table_name, column_name):
+        """Returns the 'Table.Column's with foreign keys to a column."""
+        self._foreign_key_rows()
+        return self._fk_index.get((table_name, column_name), [])
+
+    def _column_type_map(self):
+        """
+        Maps column names to the SQLAlchemy types of the already reflected
+        tables (without reflecting any others). Names with different types in
+        different tables are left out.
+        """
+        if self._column_types is None:
+            types = {}
+            ambiguous = set()
+            for tbl in self.meta.tables.values():
+                for column in tbl.columns:
+                    other = types.setdefault(column.name, column.type)
+                    if type(other) is not type(column.type):
+                        ambiguous.add(column.name)
+            for name in ambiguous:
+                del types[name]
+            self._column_types = types
+        return self._column_types
+
     def foreign_keys(self):
         """Returns a DataFrame of foreign key relationships."""
         ref_cols = ["Table", "Column", "Foreign Table", "Foreign Key"]
-        reference_df = pd.DataFrame([], columns=ref_cols)
-        for table_name in self._d.table_names:
-            try:
-                tbl = self.meta.tables[table_name]
-                for const in tbl.foreign_key_constraints:
-                    for col_name, column in const.columns.items():
-                        target = [fk.target_fullname for fk
-                                  in column.foreign_keys][0]
-                        f_table, f_col = target.split(".")
-                        row = [table_name, col_name, f_table, f_col]
-                        reference_df = reference_df.append(
-                            pd.DataFrame([row], columns=ref_cols))
-            except KeyError:
-                pass
-        return reference_df.reset_index(drop=True)
+        return pd.DataFrame(self._foreign_key_rows(), columns=ref_cols)
+
+    def __getattr__(self, name):
+        """Reflects a table the first time it is accessed."""
+        if name.startswith("_") or name == "meta":
+            raise AttributeError(name)
+        # A valid snapshot provides every table without reflecting any
+        if not self._snapshot_checked and self._load_snapshot():
+            return getattr(self, name)
+        table_name = self._names.get(name)
+        if table_name is None:
+            # The table may have been created since the names were cached
+            self._table_names = None
+            table_name = self._names.get(name)
+        if table_name is None:
+            raise AttributeError(
+                "'Schema' object has no attribute '{}'".format(name))
+        self._reflect([table_name])
+        return self.__dict__[name]
+
+    def __dir__(self):
+        # Include unreflected tables for auto-completion
+        return sorted(set(dir(type(self))) | set(self.__dict__)
+                      | set(self._names))
 
     def __str__(self):
         s = "<Schema ({}): {}>"
@@ -6,16 +6,24 @@ Misc functions and helpers.
 from __future__ import unicode_literals
 
 import base64
+import datetime
 import inspect
 import json
+import numbers
 import re
 import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from dateutil.parser import parse as parse_date
 from decimal import Decimal
 
+import numpy as np
 import pandas as pd
 import sqlparse
 from prettytable import PrettyTable
+from sqlalchemy import types as sqltypes
 
 import db2
 
@@ -68,12 +76,143 @@ def decimals_to_floats(col):
     >>> converted = decimals_to_floats(df)
     >>> converted["D"].tolist() == [2.0, 1.0]
     True
+    >>> str(converted["D"].dtype)
+    'float64'
     """
-    if any(set(col.apply(lambda x: isinstance(x, Decimal)))):
-        return pd.to_numeric(col)
+    if isinstance(col, pd.DataFrame):
+        return col.apply(decimals_to_floats)
+    # Only the first value is checked; a column of Decimals has no other type
+    if col.dtype == object and isinstance(
+            col.get(col.first_valid_index()), Decimal):
+        return col.astype(np.float64)
     return col
 
 
+def sa_type_dtype(sa_type):
+    """
+    Returns the kind of pandas dtype ("int", "float", "datetime", "bool",
+    "category" or None) for values of a SQLAlchemy column type.
+    """
+    # Enum is a String, and Numeric a parent of Integer and Float
+    if isinstance(sa_type, sqltypes.Enum):
+        return "category"
+    elif isinstance(sa_type, sqltypes.Integer):
+        return "int"
+    elif isinstance(sa_type, sqltypes.Numeric):
+        return "float"
+    elif isinstance(sa_type, (sqltypes.DateTime, sqltypes.Date)):
+        return "datetime"
+    elif isinstance(sa_type, sqltypes.Boolean):
+        return "bool"
+    return None
+
+
+def apply_dtypes(df, dtypes):
+    """
+    Converts DataFrame columns in place with vectorized conversions.
+
+    Parameters
+    ----------
+    df: DataFrame
+    dtypes: list
+        The kind of dtype for each column, by position (see
+        ``sa_type_dtype``; "number" converts DBAPI numbers to int or float).
+        Columns with a kind of None, or that fail to convert, are unchanged.
+    """
+    # Assign by position in case of duplicate column names
+    columns = df.columns
+    df.columns = range(len(columns))
+    for i, kind in enumerate(dtypes):
+        if kind is None:
+            continue
+        col = df[i]
+        try:
+            if kind == "number":
+                col = decimals_to_floats(col)
+                if col.dtype == object:
+                    col = pd.to_numeric(col)
+            elif kind == "int":
+                col = pd.to_numeric(decimals_to_floats(col))
+                # Types are matched by column name, so a computed column
+                # may hold fractions; those stay floats
+                if (col.dropna() % 1 == 0).all():
+                    # Nullable ints rather than floats if there are NULLs
+                    col = col.astype(
+                        "Int64" if col.isnull().any() else np.int64)
+            elif kind == "float":
+                col = col.astype(np.float64)
+            elif kind == "datetime":
+                col = pd.to_datetime(col)
+            elif kind == "bool":
+                col = col.astype("boolean")
+            elif kind == "category":
+                col = col.astype("category")
+        except (TypeError, ValueError, OverflowError):
+            continue
+        df[i] = col
+    df.columns = columns
+    return df
+
+
+# =============================================================================
+# Columnar Fetch Functions:
+# =============================================================================
+
+def column_kind(type_code, dbapi=None, value=None):
+    """
+    Returns the kind of array ("number", "datetime" or "object") to fetch a
+    result column into. Uses the cursor description's ``type_code`` if the
+    DBAPI module defines type objects, else the type of a sample value.
+
+    Example
+    -------
+    >>> from db2.utils import column_kind
+    >>> column_kind(None, value=1.5)
+    'number'
+    """
+    if type_code is not None and hasattr(dbapi, "NUMBER"):
+        if type_code == dbapi.NUMBER:
+            return "number"
+        elif type_code == dbapi.DATETIME:
+            return "datetime"
+        return "object"
+    if isinstance(value, numbers.Number):
+        return "number"
+    elif isinstance(value, datetime.datetime):
+        return "datetime"
+    return "object"
+
+
+def column_array(values, kind):
+    """
+    Converts a sequence of fetched values to a NumPy array. Numbers become
+    int64 (or float64 if there are NULLs or fractions), naive datetimes
+    become datetime64 and everything else, including columns of mixed types
+    and timezone-aware datetimes, stays as Python objects.
+    """
+    if kind == "number":
+        arr = np.array(values)
+        if arr.dtype.kind in "biuf":
+            return arr
+        # NULLs (NaN) or decimal.Decimals, but not e.g. strings
+        if all(v is None or isinstance(v, numbers.Number) for v in values):
+            try:
+                return arr.astype(np.float64)
+            except (TypeError, ValueError):
+                pass
+    elif kind == "datetime":
+        # NumPy would silently convert aware datetimes to naive UTC
+        if all(v is None or (isinstance(v, datetime.datetime)
+                             and v.tzinfo is None) for v in values):
+            try:
+                return np.array(values, dtype="datetime64[ns]")
+            except (TypeError, ValueError):
+                pass
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
 # =============================================================================
 # Parsed SQL Functions:
 # =============================================================================
@@ -107,30 +246,339 @@ def is_query(parsed_sql):
         tokens[1]).__name__ == "Function"
 
 
+ParsedStatement = namedtuple("ParsedStatement", ["value", "is_query"])
+
+
+def _split_simple(sql):
+    """
+    Split and classify plain, single-statement SQL without sqlparse.
+    Returns None if the SQL needs the full parser.
+    """
+    stripped = sql.rstrip(" \t")
+    body = stripped[:-1] if stripped.endswith(";") else stripped
+    if ";" in body or "--" in sql or "/*" in sql or not body.strip():
+        return None
+    keyword = body.split(None, 1)[0].upper()
+    # Any parentheses could make the second token a function (not a query)
+    if keyword == "SELECT" and "(" not in body:
+        return (ParsedStatement(sql, True),)
+    elif keyword in ("SELECT", "WITH"):
+        return None
+    return (ParsedStatement(sql, False),)
+
+
+def _split_parsed(sql):
+    """Split and classify SQL with sqlparse."""
+    parsed = [ParsedStatement(stmt.value, is_query(stmt))
+              for stmt in sqlparse.parse(sql)]
+    # Append floating 'END;' statements to the statements preceding them
+    lower_parsed = [i.value.strip().lower() for i in parsed]
+    if "end;" in lower_parsed:
+        indices = [i for i, x in enumerate(lower_parsed) if x == "end;"]
+        indices.sort(reverse=True)
+        for i in indices:
+            parsed[i-1] = parsed[i-1]._replace(
+                value=parsed[i-1].value + "\nEND;")
+            parsed.pop(i)
+    return tuple(parsed)
+
+
+def split_sql(sql):
+    """
+    Split SQL into statements and classify each one with ``is_query``.
+    Trigger bodies that sqlparse splits at their final 'END;' are re-joined.
+    Results are cached by SQL text (see ``db2.options["parse_cache_size"]``)
+    and plain single statements skip sqlparse altogether.
+
+    Parameters
+    ----------
+    sql: str
+        SQL statement(s)
+
+    Returns
+    -------
+    tuple
+        A tuple of ``ParsedStatement(value, is_query)`` namedtuples.
+
+    Example
+    -------
+    >>> from db2.utils import split_sql
+    >>> [s.is_query for s in split_sql(
+    ...     "CREATE TABLE t (id INT); SELECT * FROM t;")]
+    [False, True]
+    """
+    _statement_cache.maxsize = db2.options["parse_cache_size"]
+    parsed = _statement_cache.get(sql)
+    if parsed is None:
+        parsed = _split_simple(sql)
+        if parsed is None:
+            parsed = _split_parsed(sql)
+        _statement_cache.put(sql, parsed)
+    return parsed
+
+
+# Tokens that open a quote or comment, end a statement, or open and close a
+# BEGIN ... END block
+_SPLIT_TOKENS = re.compile(
+    r"'|\"|`|\[|--|/\*|;|\$[A-Za-z_]*\$|\b(?:BEGIN|CASE|END)\b", re.I)
+_SPLIT_CLOSING = {"'": "'", '"': '"', "`": "`", "[": "]", "--": "\n",
+                  "/*": "*/"}
+_FIRST_WORD = re.compile(r"[A-Za-z_]+")
+
+
+class StatementSplitter(object):
+    """
+    Splits SQL into statements incrementally, so scripts can be executed as
+    they are read. Semicolons in quotes, comments, dollar-quoted bodies and
+    the ``BEGIN ... END`` blocks of ``CREATE`` statements (e.g. triggers)
+    don't end a statement. Only the current statement is kept in memory.
+    Text must be fed in pieces that don't split tokens, such as lines.
+
+    Example
+    -------
+    >>> from db2.utils import StatementSplitter
+    >>> splitter = StatementSplitter()
+    >>> [str(s) for s in splitter.feed("SELECT ';'; SELECT")]
+    ["SELECT ';';"]
+    >>> [str(s) for s in splitter.feed(" 2;")]
+    ['SELECT 2;']
+    """
+    def __init__(self):
+        self._parts = []
+        # What ends the current quote or comment
+        self._closing = None
+        self._first_word = None
+        self._depth = 0
+
+    def _flush(self):
+        """Returns the current statement (None if it's blank) and resets."""
+        stmt = "".join(self._parts).strip()
+        first_word = self._first_word
+        self._parts = []
+        self._first_word = None
+        self._depth = 0
+        return stmt if first_word else None
+
+    def feed(self, text):
+        """Yields the statements completed by ``text``."""
+        pos = 0
+        while pos < len(text):
+            if self._closing is not None:
+                end = text.find(self._closing, pos)
+                if end == -1:
+                    self._parts.append(text[pos:])
+                    return
+                end += len(self._closing)
+                self._parts.append(text[pos:end])
+                self._closing = None
+                pos = end
+                continue
+            match = _SPLIT_TOKENS.search(text, pos)
+            end = match.start() if match else len(text)
+            if self._first_word is None:
+                word = _FIRST_WORD.search(text, pos, end)
+                if word:
+                    self._first_word = word.group().upper()
+            if match is None:
+                self._parts.append(text[pos:])
+                return
+            token = match.group()
+            self._parts.append(text[pos:match.end()])
+            pos = match.end()
+            if token == ";":
+                if self._depth == 0:
+                    stmt = self._flush()
+                    if stmt:
+                        yield stmt
+            elif token[0].isalpha():
+                if self._first_word is None:
+                    self._first_word = token.upper()
+                if self._first_word == "CREATE":
+                    if token.upper() == "END":
+                        self._depth = max(self._depth - 1, 0)
+                    else:
+                        self._depth += 1
+            elif token.startswith("$"):
+                self._closing = token
+            else:
+                self._closing = _SPLIT_CLOSING[token]
+        return
+
+    def close(self):
+        """Returns the final statement if it wasn't terminated (or None)."""
+        self._closing = None
+        return self._flush()
+
+
+_KEYWORD = re.compile(r"(?:\s|--[^\n]*|/\*.*?\*/)*([A-Za-z_]+)", re.S)
+
+
+def statement_keyword(stmt):
+    """
+    Returns the first keyword of an SQL statement (after any comments) in
+    upper case, or None.
+
+    Example
+    -------
+    >>> from db2.utils import statement_keyword
+    >>> str(statement_keyword("-- Comment\\n/* ; */ insert INTO t VALUES (1);"))
+    'INSERT'
+    """
+    match = _KEYWORD.match(stmt)
+    return match.group(1).upper() if match else None
+
+
+def iter_statements(lines):
+    """
+    Yields the SQL statements in an iterable of strings (e.g. a file's lines)
+    with a ``StatementSplitter``.
+    """
+    splitter = StatementSplitter()
+    for line in lines:
+        for stmt in splitter.feed(line):
+            yield stmt
+    stmt = splitter.close()
+    if stmt:
+        yield stmt
+
+
 # =============================================================================
 # SQL Functions:
 # =============================================================================
 
+def sqlite_function(name=None, deterministic=False, cache_size=None):
+    """
+    Decorator that sets how ``make_sqlite_function`` registers a function or
+    aggregate/window class.
+
+    Parameters
+    ----------
+    name: str
+        Name of the function in SQL (default: the Python name).
+    deterministic: bool
+        The function always returns the same result for the same arguments,
+        so SQLite can use it in indexes and evaluate it once per statement
+        for constant arguments (Python 3.8+). Deterministic scalar functions
+        are also memoized.
+    cache_size: int
+        Maximum number of results to memoize for a deterministic scalar
+        function (default: ``db2.options["sqlite_function_cache_size"]``; 0
+        disables memoization).
+
+    Example
+    -------
+    >>> from db2 import SQLiteDB
+    >>> from db2.utils import sqlite_function
+    >>> @sqlite_function(deterministic=True)
+    ... def double(x):
+    ...     return x * 2
+    >>> d = SQLiteDB(":memory:", functions=[double])
+    >>> int(d.sql("SELECT double(21) AS answer")["answer"].iat[0])
+    42
+    """
+    def decorator(func):
+        func._sqlite_name = name
+        func._sqlite_deterministic = deterministic
+        func._sqlite_cache_size = cache_size
+        return func
+    return decorator
+
+
+def _num_args(func, skip=0):
+    """Number of positional arguments (-1 for ``*args``)."""
+    try:
+        spec = inspect.getfullargspec(func)
+    except AttributeError:
+        spec = inspect.getargspec(func)
+    if spec.varargs:
+        return -1
+    return len(spec.args) - skip
+
+
+def _memoize(func, cache_size):
+    """Wraps a pure function with a bounded cache of its results."""
+    cache = LRUCache(cache_size)
+    missing = object()
+
+    def memoized(*args):
+        # 1, 1.0 and True are equal, but may give different results
+        key = tuple((type(a), a) for a in args)
+        result = cache.get(key, missing)
+        if result is missing:
+            result = func(*args)
+            cache.put(key, result)
+        return result
+    memoized.cache = cache
+    return memoized
+
+
 def make_sqlite_function(conn, func):
     """
     Load a Python function into an SQLite database for use in SQL statements.
 
+    Classes are registered as aggregate functions (with ``step`` and
+    ``finalize`` methods) or, if they also have ``value`` and ``inverse``
+    methods, as aggregate window functions (Python 3.11+ with SQLite
+    3.25+). Options set with the ``sqlite_function`` decorator are applied.
+
     Parameters
     ----------
     conn: sqlite3.connection
         The DB API connection to the SQLite database.
-    func: function
-        The Python function to use in the SQLite database.
+    func: function, class
+        The Python function or aggregate class to use in the SQLite database.
     """
-    name = func.__name__
-    try:
-        num_args = len(inspect.getfullargspec(func).args)
-    except AttributeError:
-        num_args = len(inspect.getargspec(func).args)
+    name = getattr(func, "_sqlite_name", None) or func.__name__
+    deterministic = getattr(func, "_sqlite_deterministic", False)
+    if inspect.isclass(func):
+        num_args = _num_args(func.step, skip=1)
+        if (hasattr(func, "value") and hasattr(func, "inverse")
+                and hasattr(conn, "create_window_function")):
+            conn.create_window_function(name, num_args, func)
+        else:
+            conn.create_aggregate(name, num_args, func)
+        return
+    num_args = _num_args(func)
+    if deterministic:
+        cache_size = getattr(func, "_sqlite_cache_size", None)
+        if cache_size is None:
+            cache_size = db2.options["sqlite_function_cache_size"]
+        if cache_size > 0:
+            func = _memoize(func, cache_size)
+        try:
+            conn.create_function(name, num_args, func, deterministic=True)
+            return
+        except (TypeError, sqlite3.NotSupportedError):
+            # Python < 3.8 or SQLite < 3.8.3
+            pass
     conn.create_function(name, num_args, func)
     return
 
 
+# Dates and datetimes that ``pystrftime`` parses without dateutil
+_ISO_DATETIME = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[ T](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?$")
+
+
+def _parse_iso(timestring):
+    """Parses ISO-8601 dates and naive datetimes, else returns None."""
+    match = _ISO_DATETIME.match(timestring)
+    if match is None:
+        return None
+    parts = match.groups()
+    fraction = parts[6] or "0"
+    try:
+        return datetime.datetime(
+            int(parts[0]), int(parts[1]), int(parts[2]), int(parts[3] or 0),
+            int(parts[4] or 0), int(parts[5] or 0),
+            int(fraction.ljust(6, "0")))
+    except ValueError:
+        # Out of range (e.g. '2020-02-30'); let dateutil decide
+        return None
+
+
+@sqlite_function(deterministic=True)
 def pystrftime(directive, timestring):
     """
     Provides a ``strftime``-comparable SQL function that leverages Python's
@@ -165,7 +613,10 @@ def pystrftime(directive, timestring):
     .. _SQLite: https://sqlite.org/lang_datefunc.html
     .. _datetime: https://docs.python.org/2/library/datetime.html#strftime-and-strptime-behavior
     """
-    return parse_date(timestring).strftime(directive)
+    date_time = _parse_iso(timestring)
+    if date_time is None:
+        date_time = parse_date(timestring)
+    return date_time.strftime(directive)
 
 
 # =============================================================================
@@ -173,6 +624,25 @@ def pystrftime(directive, timestring):
 # =============================================================================
 
 
+def chunks(iterable, size):
+    """
+    Yields lists of at most ``size`` items from ``iterable``.
+
+    Example
+    -------
+    >>> list(chunks(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def df_to_prettytable(df, name=None):
     """
     Convert a DataFrame as to a PrettyTable string.
@@ -213,6 +683,207 @@ def df_to_prettytable(df, name=None):
     return "\n{}\n".format(str(pt))
 
 
+class LRUCache(object):
+    """
+    A thread-safe, least-recently-used mapping with hit/miss counters.
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of entries to keep. Setting ``maxsize`` to 0 disables
+        caching (every lookup is a miss).
+
+    Example
+    -------
+    >>> cache = LRUCache(2)
+    >>> cache.put("a", 1)
+    >>> cache.put("b", 2)
+    >>> cache.get("a")
+    1
+    >>> cache.put("c", 3)  # "b" is evicted
+    >>> cache.get("b") is None
+    True
+    >>> cache.info() == {"hits": 1, "misses": 1, "size": 2, "maxsize": 2}
+    True
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for ``key`` and marks it as recent."""
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Caches ``value`` under ``key``, evicting the oldest entries."""
+        with self._lock:
+            self._data.pop(key, None)
+            if self.maxsize <= 0:
+                return
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return
+
+    def clear(self):
+        """Empties the cache and resets the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+        return
+
+    def info(self):
+        """Returns a dictionary of cache statistics."""
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._data), "maxsize": self.maxsize}
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Split statements by SQL text (see split_sql)
+_statement_cache = LRUCache()
+
+
+class ResultCache(object):
+    """
+    A thread-safe cache of query result DataFrames, limited by memory use and
+    age. The least recently used results are evicted first.
+
+    Parameters
+    ----------
+    max_bytes: int
+        Maximum total memory used by the cached DataFrames.
+    ttl: int, float, None
+        Seconds before a cached result expires; None never expires.
+
+    Example
+    -------
+    >>> import pandas as pd
+    >>> cache = ResultCache(1024 ** 2)
+    >>> key = cache.make_key("SELECT * FROM Artist", None)
+    >>> cache.put(key, pd.DataFrame([[1, "AC/DC"]], columns=["Id", "Name"]))
+    >>> cache.get(cache.make_key("SELECT *\\n  FROM Artist;", None)).shape
+    (1, 2)
+    >>> cache.invalidate("artist")
+    >>> len(cache)
+    0
+    """
+    # Quoted strings (kept as-is) or runs of whitespace
+    _normalize_pattern = re.compile(
+        r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _freeze(data):
+        """Converts query parameters to a hashable key."""
+        if isinstance(data, dict):
+            return tuple(sorted(
+                (k, ResultCache._freeze(v)) for k, v in data.items()))
+        if isinstance(data, (list, tuple)):
+            return tuple(ResultCache._freeze(v) for v in data)
+        return data
+
+    @classmethod
+    def make_key(cls, sql, data):
+        """
+        Returns a cache key for SQL and its parameters. Whitespace outside of
+        quoted strings and trailing semicolons don't change the key.
+        """
+        sql = cls._normalize_pattern.sub(
+            lambda m: m.group(1) or " ", sql).strip().rstrip(";").strip()
+        return (sql, cls._freeze(data))
+
+    def get(self, key):
+        """Returns a cached DataFrame, or None if missing or expired."""
+        with self._lock:
+            try:
+                df, nbytes, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and expires < time.time():
+                self.nbytes -= nbytes
+                self.misses += 1
+                return None
+            self._data[key] = (df, nbytes, expires)
+            self.hits += 1
+            return df
+
+    def put(self, key, df):
+        """Caches a DataFrame, evicting old results to stay under the cap."""
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return
+            while self._data and self.nbytes + nbytes > self.max_bytes:
+                self._discard(next(iter(self._data)))
+            self._data[key] = (df, nbytes, expires)
+            self.nbytes += nbytes
+        return
+
+    def _discard(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+        return
+
+    def invalidate(self, table_name=None):
+        """
+        Drops the cached results whose SQL mentions ``table_name``, or all
+        results if no table is given. Handlebars templates may name the table
+        only in their data, so they are always dropped.
+        """
+        with self._lock:
+            if table_name is None:
+                self._data.clear()
+                self.nbytes = 0
+                return
+            # MSSQL names may be qualified (e.g. 'dbo.MyTable')
+            name = re.escape(table_name.split(".")[-1])
+            pattern = re.compile(r"\b{}\b".format(name), re.IGNORECASE)
+            for key in [k for k in self._data
+                        if "{{" in k[0] or pattern.search(k[0])]:
+                self._discard(key)
+        return
+
+    def info(self):
+        """Returns a dictionary of cache statistics."""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / float(lookups) if lookups else 0.0,
+                "entries": len(self._data), "bytes": self.nbytes,
+                "max_bytes": self.max_bytes}
+
+    def __len__(self):
+        return len(self._data)
+
+
 class ProfileHandler:
     # ProfileHandler.load("/path/to/my/profile.json")
     # ms = db2.MSSQLDB(profile="/path/to/my/profile")
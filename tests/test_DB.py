@@ -5,11 +5,14 @@ Test db module
 
 from __future__ import unicode_literals
 
+import os
 import unittest
 
 import pandas as pd
+from sqlalchemy.event import listen
 
-from db2 import DB, SQLiteDB
+import db2
+from db2 import DB, PostgresDB, SQLiteDB
 
 
 CHINOOK = "tests/chinook.sqlite"
@@ -106,6 +109,12 @@ class TestSQL(unittest.TestCase):
         r = self.d.sql("SELECT * FROM test")
         self.assertTrue(r["name"].tolist() == ["One", "Two"])
 
+    def test_executemany_query(self):
+        # Queries run once per row, returning the last result
+        d = SQLiteDB(CHINOOK)
+        r = d.sql("SELECT * FROM Artist WHERE ArtistId = ?", [(1,), (2,)])
+        self.assertEqual(r.values.tolist(), [[2, "Accept"]])
+
     def test_executemany_handlebars(self):
         self.create_test_table()
         # Test executemany, handlebars
@@ -120,6 +129,52 @@ class TestSQL(unittest.TestCase):
         r = self.d.execute_script_file("./tests/many_statements.sql")
         self.assertTrue(len(r) == 11)
 
+    def test_many_from_file_streamed(self):
+        self.create_test_table()
+        progress = []
+        r = self.d.execute_script_file("./tests/many_statements.sql",
+                                       stream=True, batch_size=4,
+                                       progress=progress.append)
+        self.assertEqual(r.values.tolist(),
+                         [["./tests/many_statements.sql", 10]])
+        self.assertEqual([p.statements for p in progress], [4, 8, 10])
+        self.assertEqual(progress[-1].bytes_read, progress[-1].total_bytes)
+        r = self.d.sql("SELECT status, comment FROM fees")
+        self.assertEqual(r.values.tolist(), [["Waived", "Because reasons"]])
+
+    def test_streamed_commented_transaction(self):
+        with open("./tests/test_stream.sql", "w") as f:
+            f.write("-- dump header\n"
+                    "BEGIN TRANSACTION;\n"
+                    "CREATE TABLE t1 (id INT);\n"
+                    "INSERT INTO t1 VALUES (1);\n"
+                    "/* done */ COMMIT;\n")
+        try:
+            r = self.d.execute_script_file("./tests/test_stream.sql",
+                                           stream=True)
+        finally:
+            os.remove("./tests/test_stream.sql")
+        self.assertEqual(r["Result"].tolist(), [2])
+        self.assertEqual(self.d.sql("SELECT * FROM t1")["id"].tolist(), [1])
+
+    def test_streamed_batch_rollback(self):
+        with open("./tests/test_stream.sql", "w") as f:
+            f.write("BEGIN TRANSACTION;\n"
+                    "CREATE TABLE t1 (id INT);\n"
+                    "INSERT INTO t1 VALUES ({{n}});\n"
+                    "COMMIT;\n"
+                    "INSERT INTO t1 VALUES (2);\n"
+                    "INSERT INTO missing VALUES (3);\n")
+        try:
+            with self.assertRaises(Exception):
+                self.d.execute_script_file("./tests/test_stream.sql",
+                                           data={"n": 1}, stream=True,
+                                           batch_size=2)
+        finally:
+            os.remove("./tests/test_stream.sql")
+        # Only the failed batch is rolled back
+        self.assertEqual(self.d.sql("SELECT * FROM t1")["id"].tolist(), [1])
+
     def test_single_select_novars(self):
         self.create_test_table()
         self.d.sql("INSERT INTO test VALUES (1, 'One'); "
@@ -184,6 +239,89 @@ class TestSQL(unittest.TestCase):
         self.assertEqual(r.columns.tolist(), ["Band", "Albums"])
         self.assertEqual(r[r["Band"] == "Led Zeppelin"]["Albums"].iat[0], 14)
 
+    def test_sql_chunksize(self):
+        d = SQLiteDB(CHINOOK)
+        chunks = d.sql("SELECT * FROM Track", chunksize=1000)
+        self.assertFalse(isinstance(chunks, pd.DataFrame))
+        sizes = [len(df) for df in chunks]
+        self.assertEqual(sizes, [1000, 1000, 1000, 503])
+
+    def test_sql_chunksize_script(self):
+        self.create_test_table()
+        chunks = self.d.sql(
+            "INSERT INTO test VALUES (1, 'One'); "
+            "INSERT INTO test VALUES (2, 'Two'); "
+            "SELECT * FROM test;", chunksize=1)
+        self.assertEqual(
+            [df["name"].tolist() for df in chunks], [["One"], ["Two"]])
+        # Scripts without queries yield the summary DataFrame
+        summary = list(self.d.sql("DELETE FROM test;", chunksize=1))
+        self.assertEqual(len(summary), 1)
+        self.assertEqual(summary[0].columns.tolist(), ["SQL", "Result"])
+
+    def test_sql_chunksize_eager(self):
+        self.create_test_table()
+        # Statements run without iterating over the result
+        self.d.sql("INSERT INTO test VALUES (1, 'One');", chunksize=10)
+        chunks = self.d.sql("INSERT INTO test VALUES (2, 'Two'); "
+                            "SELECT * FROM test;", chunksize=10)
+        self.assertEqual(len(self.d.sql("SELECT * FROM test")), 2)
+        self.assertEqual(len(next(chunks)), 2)
+        chunks.close()
+        # Statements after the streamed query would be skipped
+        with self.assertRaises(AttributeError):
+            self.d.sql("SELECT * FROM test; INSERT INTO test VALUES (3, 'x');",
+                       chunksize=10)
+        with self.assertRaises(AttributeError):
+            self.d.sql("SELECT * FROM test; SELECT * FROM test;",
+                       chunksize=10)
+        self.assertEqual(len(self.d.sql("SELECT * FROM test")), 2)
+
+    def test_server_side_cursor_options(self):
+        d = SQLiteDB(CHINOOK)
+        # Pretend the driver supports server-side cursors
+        d._server_side_cursors = True
+        options = []
+        listen(d.engine, "before_cursor_execute",
+               lambda conn, cursor, stmt, params, context, many:
+               options.append(context.execution_options))
+        self.assertEqual(len(d.sql("SELECT * FROM Artist")), 275)
+        r = list(d.iter_sql("SELECT * FROM Artist", chunksize=100))
+        self.assertEqual([len(df) for df in r], [100, 100, 75])
+        self.assertFalse(options[0].get("stream_results", False))
+        self.assertTrue(options[1]["stream_results"])
+        self.assertEqual(options[1]["max_row_buffer"], 100)
+        fetch_size = db2.options["stream_fetch_size"]
+        db2.options["stream_fetch_size"] = 50
+        try:
+            list(d.iter_sql("SELECT * FROM Artist", chunksize=100))
+        finally:
+            db2.options["stream_fetch_size"] = fetch_size
+        self.assertEqual(options[2]["max_row_buffer"], 50)
+
+    def test_iter_sql_handlebars(self):
+        self.create_test_table()
+        r = list(self.d.iter_sql("SELECT * FROM {{tbl}}", {"tbl": "test"}))
+        self.assertEqual(len(r), 1)
+        self.assertTrue(r[0].empty)
+        self.assertEqual(r[0].columns.tolist(), ["id", "name"])
+
+        d = SQLiteDB(CHINOOK)
+        q = "SELECT '{{ name }}' AS table_name, ArtistId FROM {{ name }}"
+        r = list(d.iter_sql(q, [{"name": "Artist"}, {"name": "Album"}],
+                            chunksize=300))
+        self.assertEqual([len(df) for df in r], [300, 300, 22])
+
+    def test_template_cache(self):
+        DB._templates.clear()
+        self.create_test_table()
+        self.d.sql("INSERT INTO test VALUES ({{id}}, '{{name}}')",
+                   [{"id": i, "name": str(i)} for i in range(10)])
+        info = DB.template_cache_info()
+        self.assertEqual(info["misses"], 1)
+        self.assertEqual(info["hits"], 9)
+        self.assertEqual(info["size"], 1)
+
     def test_sql_create_results(self):
         self.create_test_table()
         # Executing two statements produces a two row dataframe
@@ -205,6 +343,182 @@ class TestSQL(unittest.TestCase):
         self.assertEqual(two["Result"].iloc[0], 1)
 
 
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.d = SQLiteDB(":memory:")
+        self.d.sql("CREATE TABLE test (id INT PRIMARY KEY, name TEXT);")
+        self.d.sql("INSERT INTO test VALUES (?, ?)", [(1, "One"), (2, "Two")])
+        self.d.enable_result_cache()
+
+    def test_hits(self):
+        r1 = self.d.sql("SELECT * FROM test WHERE id > :id", {"id": 0})
+        r2 = self.d.sql("SELECT *  FROM test\nWHERE id > :id;", {"id": 0})
+        self.d.sql("SELECT * FROM test WHERE id > :id", {"id": 1})
+        self.assertTrue(r1.equals(r2))
+        self.assertFalse(r1 is r2)
+        info = self.d.result_cache.info()
+        self.assertEqual((info["hits"], info["misses"]), (1, 2))
+        self.assertEqual(info["entries"], 2)
+        self.assertTrue(info["bytes"] > 0)
+
+    def test_invalidate_on_write(self):
+        self.assertEqual(len(self.d.sql("SELECT * FROM test")), 2)
+        self.d.sql("INSERT INTO test VALUES (3, 'Three');")
+        self.assertEqual(len(self.d.result_cache), 0)
+        self.assertEqual(len(self.d.sql("SELECT * FROM test")), 3)
+
+    def test_invalidate_on_load(self):
+        self.d.sql("SELECT * FROM test")
+        self.d.sql("SELECT 1 AS one")
+        df = pd.DataFrame([[4, "Four"]], columns=["id", "name"])
+        self.d.load_dataframe(df, "test", if_exists="append")
+        self.assertEqual(len(self.d.result_cache), 1)
+        self.assertEqual(len(self.d.sql("SELECT * FROM test")), 3)
+
+    def test_invalidate_template(self):
+        # The table is only named in the handlebars data
+        q = "SELECT * FROM {{ tbl }}"
+        self.assertEqual(len(self.d.sql(q, {"tbl": "test"})), 2)
+        df = pd.DataFrame([[4, "Four"]], columns=["id", "name"])
+        self.d.load_dataframe(df, "test", if_exists="append")
+        self.assertEqual(len(self.d.sql(q, {"tbl": "test"})), 3)
+
+    def test_limits(self):
+        self.d.enable_result_cache(max_bytes=1)
+        self.d.sql("SELECT * FROM test")
+        self.assertEqual(len(self.d.result_cache), 0)
+        self.d.enable_result_cache(ttl=-1)
+        self.d.sql("SELECT * FROM test")
+        self.d.sql("SELECT * FROM test")
+        self.assertEqual(self.d.result_cache.hits, 0)
+        self.d.disable_result_cache()
+        self.assertTrue(self.d.result_cache is None)
+
+
+class TestSQLMany(unittest.TestCase):
+    def test_sql_many_order(self):
+        d = SQLiteDB(CHINOOK)
+        queries = ["SELECT * FROM Artist",
+                   ("SELECT * FROM Album WHERE ArtistId = ?", (1,)),
+                   "SELECT * FROM Genre",
+                   "SELECT * FROM MediaType"]
+        results = d.sql_many(queries, max_workers=3)
+        self.assertEqual([len(r.df) for r in results], [275, 2, 25, 5])
+        self.assertEqual(results[1].sql, queries[1][0])
+        self.assertTrue(all(r.seconds >= 0 for r in results))
+
+    def test_sql_many_memory(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT PRIMARY KEY);")
+        d.sql("INSERT INTO test VALUES (?)", [(1,), (2,)])
+        results = d.sql_many(["SELECT * FROM test", "SELECT 1 AS one"])
+        self.assertEqual(results[0].df["id"].tolist(), [1, 2])
+        self.assertEqual(results[1].df["one"].tolist(), [1])
+
+
+class TestColumnarFetch(unittest.TestCase):
+    def setUp(self):
+        self.d = SQLiteDB(CHINOOK)
+        self.options = (db2.options["columnar_fetch"], db2.options["chunksize"])
+        db2.options["columnar_fetch"] = True
+
+    def tearDown(self):
+        db2.options["columnar_fetch"], db2.options["chunksize"] = self.options
+
+    def test_same_as_rows(self):
+        sql = "SELECT * FROM Track"
+        df = self.d.sql(sql)
+        db2.options["columnar_fetch"] = False
+        pd.testing.assert_frame_equal(df, self.d.sql(sql))
+
+    def test_dtypes(self):
+        # Several fetch batches; Composer has NULLs
+        db2.options["chunksize"] = 1000
+        df = self.d.sql(
+            "SELECT TrackId, UnitPrice, Composer, NULL AS NoValue, "
+            "CASE WHEN TrackId > 1500 THEN NULL ELSE 1 END AS SomeNulls "
+            "FROM Track")
+        self.assertEqual(len(df), 3503)
+        self.assertEqual(
+            [str(t) for t in df.dtypes],
+            ["int64", "float64", "object", "object", "float64"])
+        self.assertEqual(df["SomeNulls"].isnull().sum(), 2003)
+
+    def test_mixed_types(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (value);")
+        d.sql("INSERT INTO test VALUES (1), ('abc'), (2);")
+        self.assertEqual(d.sql("SELECT * FROM test")["value"].tolist(),
+                         [1, "abc", 2])
+
+    def test_empty(self):
+        df = self.d.sql("SELECT * FROM Artist WHERE ArtistId < 0")
+        self.assertEqual(df.columns.tolist(), ["ArtistId", "Name"])
+        self.assertEqual(len(df), 0)
+
+
+class TestResultTyping(unittest.TestCase):
+    def setUp(self):
+        self.d = SQLiteDB(CHINOOK)
+        self.d.schema.refresh(["Invoice", "Customer"])
+        self.options = (db2.options["result_typing"],
+                        db2.options["columnar_fetch"])
+        db2.options["result_typing"] = True
+
+    def tearDown(self):
+        (db2.options["result_typing"],
+         db2.options["columnar_fetch"]) = self.options
+
+    def check_dtypes(self):
+        df = self.d.sql(
+            "SELECT i.InvoiceDate, i.Total, i.CustomerId, c.SupportRepId "
+            "FROM Customer c LEFT JOIN Invoice i "
+            "ON i.CustomerId = c.CustomerId AND i.Total > 20")
+        self.assertEqual(
+            [str(t) for t in df.dtypes],
+            ["datetime64[ns]", "float64", "Int64", "int64"])
+        self.assertEqual(str(df["InvoiceDate"].min()), "2010-02-18 00:00:00")
+        # Columns that weren't reflected are left to pandas
+        df = self.d.sql("SELECT ArtistId, Name FROM Artist")
+        self.assertEqual([str(t) for t in df.dtypes], ["int64", "object"])
+
+    def test_dtypes(self):
+        self.check_dtypes()
+
+    def test_dtypes_columnar(self):
+        db2.options["columnar_fetch"] = True
+        self.check_dtypes()
+
+    def test_computed_int_names(self):
+        # Columns named like reflected integers aren't truncated
+        df = self.d.sql("SELECT InvoiceId / 2.0 AS InvoiceId FROM Invoice "
+                        "WHERE InvoiceId IN (98, 121, 143)")
+        self.assertEqual(df["InvoiceId"].tolist(), [49.0, 60.5, 71.5])
+        df = self.d.sql("SELECT InvoiceId, AVG(Total) AS CustomerId "
+                        "FROM Invoice")
+        self.assertAlmostEqual(df["CustomerId"].iat[0], 5.65, places=2)
+        df = self.d.sql("SELECT InvoiceId * 2.0 AS InvoiceId FROM Invoice "
+                        "WHERE InvoiceId < 3")
+        self.assertEqual(str(df["InvoiceId"].dtype), "int64")
+
+    def test_dtypes_chunks(self):
+        dfs = list(self.d.sql("SELECT InvoiceDate FROM Invoice",
+                              chunksize=100))
+        self.assertEqual(len(dfs), 5)
+        self.assertTrue(
+            all(str(df["InvoiceDate"].dtype) == "datetime64[ns]"
+                for df in dfs))
+
+
+class TestPostgresCopy(unittest.TestCase):
+    def test_copy_csv(self):
+        # COPY reads unquoted \N as NULL, and quoted values as strings
+        buf = PostgresDB._copy_csv(
+            [(1, None, "", "\\N", 'say "hi", twice', 2.5, True)])
+        self.assertEqual(buf.read(),
+                         '1,\\N,"","\\N","say ""hi"", twice",2.5,True\r\n')
+
+
 class TestDatabaseURLs(unittest.TestCase):
     def test_url(self):
         d = DB(url="sqlite:///:memory:")
@@ -3,12 +3,15 @@
 from __future__ import unicode_literals
 
 import os
+import threading
 import unittest
 from datetime import datetime
 from decimal import Decimal
 
+import pandas as pd
+
 import db2
-from db2 import SQLiteDB
+from db2 import SQLiteDB, utils
 
 CHINOOK = "tests/chinook.sqlite"
 
@@ -56,6 +59,151 @@ class TestSQLite(unittest.TestCase):
         self.assertEqual(ddate,
                          now.strftime(db2.options["sqlite_datetime_format"]))
 
+    def test_executemany_batches(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT PRIMARY KEY, name TEXT);")
+        batch_size = db2.options["executemany_batch_size"]
+        db2.options["executemany_batch_size"] = 3
+        try:
+            r = d.sql("INSERT INTO test VALUES (?, ?)",
+                      [(i, str(i)) for i in range(10)])
+        finally:
+            db2.options["executemany_batch_size"] = batch_size
+        self.assertEqual(r["Result"].iat[0], 10)
+        self.assertEqual(len(d.sql("SELECT * FROM test")), 10)
+
+    def test_executemany_rollback(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT PRIMARY KEY, name TEXT);")
+        # The duplicate key fails the whole batch
+        with self.assertRaises(Exception):
+            d.sql("INSERT INTO test VALUES (:id, :name)",
+                  [{"id": 1, "name": "One"}, {"id": 1, "name": "One"}])
+        self.assertTrue(d.sql("SELECT * FROM test").empty)
+
+    def test_script_mode(self):
+        d = SQLiteDB(":memory:")
+        script = open("tests/many_statements.sql").read()
+        r = d.sql(script, mode="script")
+        self.assertEqual(r.columns.tolist(), ["SQL", "Result"])
+        self.assertEqual(r["Result"].tolist(), [10])
+        r = d.sql("SELECT status FROM fees")
+        self.assertEqual(r["status"].tolist(), ["Waived"])
+        with self.assertRaises(AttributeError):
+            d.sql("SELECT 1", mode="fast")
+        with self.assertRaises(AttributeError):
+            d.sql("SELECT ?", (1,), mode="script")
+
+    def test_script_mode_no_semicolon(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE a (x INT); INSERT INTO a VALUES (1)",
+              mode="script")
+        self.assertEqual(d.sql("SELECT * FROM a")["x"].tolist(), [1])
+
+    def test_script_mode_in_transaction(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT);")
+        with self.assertRaises(KeyError):
+            with d.transaction():
+                d.sql("INSERT INTO test VALUES (1); "
+                      "INSERT INTO test VALUES (2);", mode="auto")
+                raise KeyError("roll back")
+        # The script didn't commit the transaction
+        self.assertTrue(d.sql("SELECT * FROM test").empty)
+        with d.transaction():
+            with self.assertRaises(AttributeError):
+                d.sql("INSERT INTO test VALUES (1);", mode="script")
+
+    def test_script_mode_rollback(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT PRIMARY KEY);")
+        with self.assertRaises(Exception):
+            d.sql("INSERT INTO test VALUES (1); INSERT INTO test VALUES (1);",
+                  mode="script")
+        self.assertTrue(d.sql("SELECT * FROM test").empty)
+        self.assertFalse(d.con.connection.in_transaction)
+
+    def test_script_mode_auto(self):
+        d = SQLiteDB(":memory:")
+        r = d.sql("CREATE TABLE test (id INT); INSERT INTO test VALUES (1);",
+                  mode="auto")
+        self.assertEqual(len(r), 1)
+        # Queries go through DB.sql
+        r = d.sql("INSERT INTO test VALUES (2); SELECT * FROM test;",
+                  mode="auto")
+        self.assertEqual(r["id"].tolist(), [1, 2])
+
+    def test_load_dataframe_fast(self):
+        d = SQLiteDB(":memory:")
+        df = pd.DataFrame([[1, "AC/DC", 1.5], [2, None, 2.5]],
+                          columns=["id", "name", "value"])
+        stats = d.load_dataframe(df, "test", method="fast")
+        self.assertEqual(stats["rows"], 2)
+        self.assertTrue(stats["rows_per_sec"] > 0)
+        r = d.sql("SELECT * FROM test")
+        self.assertEqual(r["name"].tolist(), ["AC/DC", None])
+        # Append and check pragmas were restored
+        d.load_dataframe(df, "test", method="fast", if_exists="append")
+        self.assertEqual(len(d.sql("SELECT * FROM test")), 4)
+        sync = d.con.execute("PRAGMA synchronous;").scalar()
+        self.assertEqual(sync, 2)
+
+    def test_create_table_as(self):
+        d = SQLiteDB(":memory:")
+        d.attach_db(CHINOOK)
+        d.create_table_as(
+            "Sales",
+            "SELECT i.InvoiceId, i.InvoiceDate, i.Total, c.Country, "
+            "i.Total * 2 AS Doubled, NULL AS NoValue "
+            "FROM chinook.Invoice i "
+            "JOIN chinook.Customer c ON i.CustomerId = c.CustomerId;")
+        info = d.con.execute("PRAGMA table_info(Sales)").fetchall()
+        self.assertEqual(
+            [row[2] for row in info],
+            ["INTEGER", "DATETIME", "NUMERIC(10,2)", "NVARCHAR(40)", "REAL",
+             ""])
+        df = d.sql("SELECT * FROM Sales")
+        self.assertEqual(len(df), 412)
+        self.assertEqual(df["InvoiceDate"][0], "2009-01-01 00:00:00")
+        # Cached results for the table are dropped
+        d.enable_result_cache()
+        self.assertEqual(len(d.sql("SELECT * FROM Sales")), 412)
+        d.con.execute("DROP TABLE Sales;")
+        d.create_table_as("Sales", "SELECT * FROM chinook.Invoice "
+                                   "WHERE Total > 10")
+        self.assertEqual(len(d.sql("SELECT * FROM Sales")), 64)
+        # The temporary view is gone, even after an error
+        with self.assertRaises(ValueError):
+            d.create_table_as("Sales", "SELECT 1 AS one")
+        with self.assertRaises(Exception):
+            d.create_table_as("Sales2", "SELECT * FROM NoTable")
+        self.assertTrue(d.sql("SELECT * FROM temp.sqlite_master").empty)
+        with self.assertRaises(AttributeError):
+            d.create_table_as("Sales", "SELECT 1", if_exists="drop")
+
+    def test_create_table_as_if_exists(self):
+        d = SQLiteDB(":memory:")
+        d.attach_db(CHINOOK)
+        d.create_table_as("Genres", "SELECT * FROM chinook.Genre")
+        d.create_table_as("Genres", "SELECT Name, GenreId + 100 AS GenreId "
+                                    "FROM chinook.Genre", if_exists="append")
+        df = d.sql("SELECT * FROM Genres")
+        self.assertEqual(len(df), 50)
+        self.assertEqual(df["GenreId"].iat[-1], 125)
+        d.create_table_as("Genres", "SELECT GenreId FROM chinook.Genre",
+                          if_exists="replace")
+        self.assertEqual(d.sql("SELECT * FROM Genres").columns.tolist(),
+                         ["GenreId"])
+
+    def test_create_table_as_pandas(self):
+        d = SQLiteDB(":memory:")
+        d.attach_db(CHINOOK)
+        d.create_table_as("Genres", "SELECT * FROM chinook.Genre",
+                          native=False, index=True)
+        self.assertEqual(
+            d.sql("SELECT * FROM Genres").columns.tolist(),
+            ["index", "GenreId", "Name"])
+
 
 class TestOnDisk_notclosed(unittest.TestCase):
     def setUp(self):
@@ -76,3 +224,99 @@ class TestOnDisk_notclosed(unittest.TestCase):
         self.d = SQLiteDB(self.path)
         df = self.d.sql("SELECT * FROM test")
         self.assertEqual(df["id"].tolist(), [1, 2])
+
+
+class TestPragmaProfiles(unittest.TestCase):
+    def setUp(self):
+        self.path = "tests/test_pragmas.sqlite"
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def tearDown(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def pragma(self, d, name):
+        return d.con.execute("PRAGMA {};".format(name)).scalar()
+
+    def test_profile(self):
+        d = SQLiteDB(self.path, pragma_profile="read_heavy")
+        self.assertEqual(self.pragma(d, "journal_mode"), "wal")
+        self.assertEqual(self.pragma(d, "page_size"), 16384)
+        self.assertEqual(self.pragma(d, "synchronous"), 1)
+        self.assertEqual(self.pragma(d, "cache_size"), -65536)
+        d.close()
+        # Explicit pragmas take precedence
+        d = SQLiteDB(self.path, pragma_profile="durable",
+                     pragmas=[("synchronous", "NORMAL")])
+        self.assertEqual(self.pragma(d, "synchronous"), 1)
+        self.assertEqual(self.pragma(d, "mmap_size"), 0)
+        d.close()
+
+    def test_pragmas_context(self):
+        d = SQLiteDB(self.path, pragma_profile="durable")
+        with d.pragmas("bulk_load"):
+            self.assertEqual(self.pragma(d, "synchronous"), 0)
+            self.assertEqual(self.pragma(d, "temp_store"), 2)
+        self.assertEqual(self.pragma(d, "synchronous"), 2)
+        self.assertEqual(self.pragma(d, "temp_store"), 0)
+        with d.pragmas([("cache_size", -1024)]):
+            self.assertEqual(self.pragma(d, "cache_size"), -1024)
+        self.assertEqual(self.pragma(d, "cache_size"), -2000)
+        d.close()
+
+    def test_validation(self):
+        with self.assertRaises(AttributeError):
+            SQLiteDB(":memory:", pragma_profile="fastest")
+        d = SQLiteDB(":memory:")
+        for settings in ([("foreign_keys", 1)], [("journal_mode", "FAST")],
+                         [("page_size", 1000)], [("mmap_size", -1)],
+                         [("cache_size", "big")]):
+            with self.assertRaises(AttributeError):
+                with d.pragmas(settings):
+                    pass
+
+
+class TestPooled(unittest.TestCase):
+    def setUp(self):
+        self.path = "tests/test_pooled.sqlite"
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.d = SQLiteDB(self.path, pooled=True, functions=[utils.pystrftime])
+        self.d.sql("CREATE TABLE test (id INT PRIMARY KEY, name TEXT);")
+        self.d.sql("INSERT INTO test VALUES (?, ?)",
+                   [(i, str(i)) for i in range(10)])
+
+    def tearDown(self):
+        self.d.close()
+        os.remove(self.path)
+
+    def test_memory_not_pooled(self):
+        with self.assertRaises(AttributeError):
+            SQLiteDB(":memory:", pooled=True)
+
+    def test_threads(self):
+        results = []
+
+        def query(i):
+            r = self.d.sql(
+                "SELECT count(*) AS cnt, pystrftime('%b', '2020-01-01') AS m "
+                "FROM test WHERE id >= ?", (i,))
+            results.append((r["cnt"].iat[0], r["m"].iat[0]))
+
+        threads = [threading.Thread(target=query, args=(i,))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(results),
+                         [(cnt, "Jan") for cnt in range(3, 11)])
+        self.assertEqual(self.d.engine.pool.checkedout(), 0)
+
+    def test_transaction(self):
+        with self.d.transaction():
+            self.d.sql("INSERT INTO test VALUES (10, 'Ten');")
+            self.d.sql("INSERT INTO test VALUES (11, 'Eleven');")
+        self.assertEqual(len(self.d.sql("SELECT * FROM test")), 12)
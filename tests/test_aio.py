@@ -0,0 +1,74 @@
+# !/usr/bin/env python3
+"""
+Test aio module
+"""
+
+import asyncio
+import sys
+import unittest
+
+import pandas as pd
+
+if sys.version_info >= (3, 6):
+    from db2 import AsyncSQLiteDB
+
+
+CHINOOK = "tests/chinook.sqlite"
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def collect(agen):
+    """Consume an async generator without async syntax."""
+    chunks = []
+    while True:
+        try:
+            chunks.append(run(agen.__anext__()))
+        except StopAsyncIteration:
+            return chunks
+
+
+@unittest.skipIf(sys.version_info < (3, 6), "requires Python 3.6+")
+class TestAsyncSQLite(unittest.TestCase):
+    def setUp(self):
+        self.d = AsyncSQLiteDB(":memory:")
+        run(self.d.sql(
+            "CREATE TABLE test (id INT PRIMARY KEY, name TEXT NOT NULL);"))
+
+    def tearDown(self):
+        run(self.d.close())
+
+    def test_sql(self):
+        run(self.d.sql("INSERT INTO test VALUES ({{id}}, '{{name}}')",
+                       [{"id": 1, "name": "One"}, {"id": 2, "name": "Two"}]))
+        r = run(self.d.sql("SELECT * FROM test WHERE id > :id", {"id": 1}))
+        self.assertEqual(r["name"].tolist(), ["Two"])
+
+    def test_load_dataframe(self):
+        df = pd.DataFrame([[1, "One"], [2, "Two"]], columns=["id", "name"])
+        run(self.d.load_dataframe(df, "test", if_exists="append"))
+        r = run(self.d.sql("SELECT * FROM test"))
+        self.assertEqual(r["name"].tolist(), ["One", "Two"])
+
+    def test_execute_script_file(self):
+        r = run(self.d.execute_script_file("./tests/many_statements.sql"))
+        self.assertEqual(len(r), 11)
+
+    def test_stream(self):
+        d = AsyncSQLiteDB(CHINOOK)
+        chunks = collect(d.stream("SELECT * FROM Artist", chunksize=100))
+        self.assertEqual([len(df) for df in chunks], [100, 100, 75])
+        run(d.close())
+
+    def test_pooled_workers(self):
+        with self.assertRaises(AttributeError):
+            AsyncSQLiteDB(CHINOOK, max_workers=2)
+        d = AsyncSQLiteDB(CHINOOK, pooled=True, max_workers=2)
+        results = run(asyncio.gather(
+            d.sql("SELECT * FROM Artist"), d.sql("SELECT * FROM Album")))
+        self.assertEqual([len(df) for df in results], [275, 347])
+        chunks = collect(d.stream("SELECT * FROM Album", chunksize=300))
+        self.assertEqual([len(df) for df in chunks], [300, 47])
+        run(d.close())
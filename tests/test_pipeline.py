@@ -0,0 +1,246 @@
+# !/usr/bin/env python2
+"""
+Test pipeline module
+"""
+
+from __future__ import unicode_literals
+
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+
+import pandas as pd
+from sqlalchemy import DateTime, Numeric, String
+from sqlalchemy.dialects import mssql
+
+from db2 import SQLiteDB, pipeline
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+CHINOOK = "tests/chinook.sqlite"
+
+
+class TestPipe(unittest.TestCase):
+    def test_order(self):
+        out = []
+        readers = [lambda n=n: range(n * 100, n * 100 + 50) for n in range(4)]
+        pipeline.pipe(readers, lambda i, item: out.append((i, item)),
+                      max_workers=3, queue_size=2)
+        self.assertEqual(len(out), 200)
+        for n in range(4):
+            self.assertEqual([item for i, item in out if i == n],
+                             list(range(n * 100, n * 100 + 50)))
+
+    def test_writer_error(self):
+        def write(i, item):
+            if item == 5:
+                raise ValueError("bad item")
+
+        with self.assertRaises(ValueError):
+            pipeline.pipe([lambda: range(1000)], write, queue_size=1)
+
+    def test_context(self):
+        threads = []
+
+        @pipeline.contextmanager
+        def context():
+            threads.append(pipeline.threading.current_thread())
+            yield
+            threads.append(None)
+
+        out = []
+        pipeline.pipe([lambda: range(3)],
+                      lambda i, item: out.append(
+                          pipeline.threading.current_thread()),
+                      context=context)
+        self.assertEqual(out, threads[:1] * 3)
+        self.assertEqual(threads[1], None)
+
+    def test_reader_error(self):
+        def read():
+            yield 1
+            raise KeyError("bad read")
+
+        out = []
+        with self.assertRaises(KeyError):
+            pipeline.pipe([lambda: range(100), read],
+                          lambda i, item: out.append(item), max_workers=2)
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.d = SQLiteDB(CHINOOK)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tables = ["Artist", "Album", "Genre"]
+
+    def tearDown(self):
+        self.d.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def sheet_rows(self, path, sheet):
+        with zipfile.ZipFile(path) as z:
+            xml = z.read("xl/worksheets/sheet{}.xml".format(sheet))
+        return len(re.findall(b"<row ", xml))
+
+    def test_excel(self):
+        path = os.path.join(self.tmp_dir, "chinook.xlsx")
+        r = self.d.export_tables(self.tables, path, chunksize=100,
+                                 max_workers=3)
+        self.assertEqual(r["Rows"].tolist(), [275, 347, 25])
+        with zipfile.ZipFile(path) as z:
+            workbook = z.read("xl/workbook.xml").decode("utf8")
+        self.assertEqual(re.findall('sheet name="(\\w+)"', workbook),
+                         self.tables)
+        # Header + rows
+        self.assertEqual(self.sheet_rows(path, 1), 276)
+        self.assertEqual(self.sheet_rows(path, 2), 348)
+
+    def test_export_tables_to_excel(self):
+        path = os.path.join(self.tmp_dir, "artist.xlsx")
+        self.d.export_tables_to_excel(
+            ["Artist", "Album"], path, ["WHERE ArtistId < 11", ""],
+            strip_regex="^Al")
+        with zipfile.ZipFile(path) as z:
+            workbook = z.read("xl/workbook.xml").decode("utf8")
+            sheet = z.read("xl/worksheets/sheet1.xml").decode("utf8")
+        self.assertEqual(re.findall('sheet name="(\\w+)"', workbook),
+                         ["Artist", "bum"])
+        self.assertEqual(self.sheet_rows(path, 1), 11)
+        # The index is written, like DataFrame.to_excel
+        self.assertTrue('<c r="C2" t="inlineStr"' in sheet)
+
+    def test_to_excel_options(self):
+        path = os.path.join(self.tmp_dir, "tracks.xlsx")
+        self.d.export_tables_to_excel(
+            ["Track"], path, ["WHERE TrackId < 3"], float_format="%.1f",
+            index=False, freeze_panes=(1, 0))
+        with zipfile.ZipFile(path) as z:
+            sheet = z.read("xl/worksheets/sheet1.xml").decode("utf8")
+        self.assertEqual(self.sheet_rows(path, 1), 3)
+        # UnitPrice 0.99 is rounded
+        self.assertFalse("<v>0.99</v>" in sheet)
+        self.assertTrue('<pane ySplit="1"' in sheet)
+        with self.assertRaises(AttributeError):
+            self.d.export_tables_to_excel(["Artist"], path, startrow=2)
+
+    def test_csv_and_jsonl(self):
+        self.d.export_tables(self.tables, self.tmp_dir, "csv", chunksize=100)
+        df = pd.read_csv(os.path.join(self.tmp_dir, "Album.csv"))
+        pd.testing.assert_frame_equal(df, self.d.sql("SELECT * FROM Album"))
+        # Written as UTF-8 with \n line endings whatever the platform
+        with open(os.path.join(self.tmp_dir, "Artist.csv"), "rb") as f:
+            raw = f.read()
+        self.assertFalse(b"\r\n" in raw)
+        self.assertTrue("Ant\u00f4nio Carlos Jobim".encode("utf-8") in raw)
+
+        self.d.export_tables(self.tables, self.tmp_dir, "jsonl",
+                             chunksize=100, index=True)
+        df = pd.read_json(os.path.join(self.tmp_dir, "Artist.jsonl"),
+                          lines=True)
+        self.assertEqual(df.columns.tolist(), ["", "ArtistId", "Name"])
+        self.assertEqual(df[""].tolist(), list(range(275)))
+
+    @unittest.skipIf(pyarrow is None, "requires pyarrow")
+    def test_parquet(self):
+        self.d.export_tables(self.tables, self.tmp_dir, "parquet",
+                             chunksize=100)
+        df = pd.read_parquet(os.path.join(self.tmp_dir, "Album.parquet"))
+        self.assertEqual(len(df), 347)
+
+    def test_bad_format(self):
+        with self.assertRaises(AttributeError):
+            self.d.export_tables(self.tables, "out.txt")
+
+    def test_memory(self):
+        # In-memory databases are read on the calling thread
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT, name TEXT);")
+        d.sql("INSERT INTO test VALUES (?, ?)", [(1, "One"), (2, None)])
+        d.export_tables(["test"], self.tmp_dir, "csv", max_workers=4)
+        df = pd.read_csv(os.path.join(self.tmp_dir, "test.csv"))
+        self.assertEqual(df["id"].tolist(), [1, 2])
+
+
+class TestCopy(unittest.TestCase):
+    def setUp(self):
+        self.src = SQLiteDB(CHINOOK)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dst = SQLiteDB(os.path.join(self.tmp_dir, "copy.sqlite"))
+
+    def tearDown(self):
+        self.src.close()
+        self.dst.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_copy_table(self):
+        reports = []
+        stats = self.src.copy_table("Album", self.dst, chunksize=100,
+                                    progress=reports.append)
+        self.assertEqual(stats["rows"], 347)
+        self.assertEqual([r.rows for r in reports], [100, 200, 300, 347])
+        self.assertEqual(reports[-1].total_rows, 347)
+        self.assertEqual(reports[-1].eta, 0)
+        pd.testing.assert_frame_equal(
+            self.dst.sql("SELECT * FROM Album"),
+            self.src.sql("SELECT * FROM Album"))
+        # Types, primary key and nullability come from the source schema
+        table = self.dst.schema.Album.Table
+        self.assertEqual(str(table.c.Title.type), "NVARCHAR(160)")
+        self.assertEqual([c.name for c in table.primary_key], ["AlbumId"])
+        self.assertFalse(table.c.Title.nullable)
+
+    def test_if_exists(self):
+        self.src.copy_table("Genre", self.dst, "Genres")
+        with self.assertRaises(ValueError):
+            self.src.copy_table("Genre", self.dst, "Genres")
+        # The primary key is kept
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.src.copy_table("Genre", self.dst, "Genres",
+                                if_exists="append")
+        self.src.copy_query("SELECT GenreId + 100 AS GenreId, Name FROM Genre",
+                            self.dst, "Genres", if_exists="append")
+        self.assertEqual(self.dst.schema.Genres.count(), 50)
+        self.src.copy_table("Genre", self.dst, "Genres", if_exists="replace")
+        self.assertEqual(len(self.dst.sql("SELECT * FROM Genres")), 25)
+        with self.assertRaises(AttributeError):
+            self.src.copy_table("NoTable", self.dst)
+        with self.assertRaises(AttributeError):
+            self.src.copy_table("Genre", self.dst, if_exists="drop")
+
+    def test_copy_query(self):
+        # Columns of reflected tables keep their types
+        self.src.schema.Invoice
+        stats = self.src.copy_query(
+            "SELECT InvoiceId, InvoiceDate, Total FROM Invoice "
+            "WHERE Total > :total", self.dst, "BigInvoices", {"total": 10},
+            chunksize=50)
+        self.assertEqual(stats["rows"], 64)
+        table = self.dst.schema.BigInvoices.Table
+        self.assertEqual(str(table.c.Total.type), "NUMERIC(10, 2)")
+        self.assertEqual(str(table.c.InvoiceDate.type), "DATETIME")
+
+    def test_memory_target(self):
+        # Written on the calling thread
+        dst = SQLiteDB(":memory:")
+        self.src.copy_table("Artist", dst, chunksize=100)
+        self.assertEqual(len(dst.sql("SELECT * FROM Artist")), 275)
+
+    def test_portable_type(self):
+        dialect = self.dst.engine.dialect
+        self.assertIsInstance(
+            pipeline.portable_type(mssql.DATETIME2(), dialect), DateTime)
+        varchar = pipeline.portable_type(
+            mssql.VARCHAR(20, collation="Latin1_General_CI_AS"), dialect)
+        self.assertEqual(str(varchar.compile(dialect=dialect)), "VARCHAR(20)")
+        self.assertIsInstance(
+            pipeline.portable_type(mssql.UNIQUEIDENTIFIER(), dialect), String)
+        self.assertIsInstance(
+            pipeline.portable_type(Numeric(10, 2), dialect), Numeric)
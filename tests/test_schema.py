@@ -3,9 +3,15 @@
 Tests the Schema and TableSchema objects when used as a database attribute.
 """
 
+import os
+import shutil
+import tempfile
 import unittest
 
-from db2 import SQLiteDB
+from sqlalchemy.event import listen
+
+import db2
+from db2 import MSSQLDB, SQLiteDB
 
 
 CHINOOK = "tests/chinook.sqlite"
@@ -32,4 +38,237 @@ class TestSchemaObject(unittest.TestCase):
         self.assertEqual(self.d.schema.Artist.name, "Artist")
         self.assertEqual(self.d.schema.Artist.columns,
                          ["ArtistId", "Name"])
-        self.assertEqual(self.d.schema.Artist.count, 275)
+        self.assertEqual(self.d.schema.Artist.count(), 275)
+
+    def test_lazy_reflection(self):
+        # Accessing a table reflects only that table
+        self.assertEqual(self.d.schema.Album.columns,
+                         ["AlbumId", "Title", "ArtistId"])
+        self.assertEqual(list(self.d.schema.meta.tables), ["Album"])
+        self.assertEqual(str(self.d.schema),
+                         "<Schema (chinook.sqlite): 1 Tables Loaded>")
+        self.assertTrue("Track" in dir(self.d.schema))
+        with self.assertRaises(AttributeError):
+            self.d.schema.NotATable
+
+    def test_lazy_reflection_new_table(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE a (id INT);")
+        self.assertEqual(d.schema.a.columns, ["id"])
+        d.sql("CREATE TABLE b (name TEXT);")
+        self.assertEqual(d.schema.b.columns, ["name"])
+        with self.assertRaises(AttributeError):
+            d.schema.c
+
+    def test_targeted_refresh(self):
+        self.d.schema.refresh(["Album"], resolve_fks=True)
+        self.assertEqual(sorted(self.d.schema.meta.tables),
+                         ["Album", "Artist"])
+        self.assertEqual(str(self.d.schema),
+                         "<Schema (chinook.sqlite): 2 Tables Loaded>")
+        with self.assertRaises(AttributeError):
+            self.d.schema.refresh(["NotATable"])
+
+    def test_refresh_changed_table(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT PRIMARY KEY);")
+        self.assertEqual(d.schema.test.columns, ["id"])
+        d.sql("ALTER TABLE test ADD COLUMN name TEXT;")
+        d.schema.refresh(["test"])
+        self.assertEqual(d.schema.test.columns, ["id", "name"])
+
+    def test_count_estimate(self):
+        artist = self.d.schema.Artist
+        # Without sqlite_stat1, the estimate is the largest rowid
+        self.assertEqual(artist.count(estimate=True), 275)
+        self.assertEqual(
+            repr(artist),
+            "<TableSchema for Artist: ~275 Rows, 2 Columns: "
+            "['ArtistId', 'Name']>")
+        self.assertEqual(artist.count(), 275)
+        self.assertTrue(repr(artist).startswith(
+            "<TableSchema for Artist: 275 Rows"))
+
+    def test_count_cached(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT);")
+        d.sql("INSERT INTO test VALUES (1), (2), (3);")
+        d.sql("ANALYZE;")
+        d.sql("DELETE FROM test WHERE id = 3;")
+        # Statistics are as of the last ANALYZE
+        self.assertEqual(d.schema.test.count(estimate=True), 3)
+        self.assertEqual(d.schema.test.count(), 2)
+        d.sql("INSERT INTO test VALUES (3);")
+        self.assertEqual(d.schema.test.count(), 2)
+        self.assertEqual(d.schema.test.count(estimate=True), 2)
+        d.schema.refresh(["test"])
+        self.assertEqual(d.schema.test.count(), 3)
+
+    def test_previews(self):
+        artist = self.d.schema.Artist
+        self.assertEqual(len(artist.all()), 275)
+        head = artist.head()
+        self.assertEqual(len(head), 10)
+        self.assertEqual(head.columns.tolist(), ["ArtistId", "Name"])
+        self.assertEqual(head["ArtistId"].iat[0], 1)
+        self.assertEqual(artist.head(3)["ArtistId"].tolist(), [1, 2, 3])
+        self.assertEqual(artist.tail(3)["ArtistId"].tolist(),
+                         [273, 274, 275])
+
+    def test_tail_without_primary_key(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT);")
+        d.sql("INSERT INTO test VALUES (1), (2), (3);")
+        self.assertEqual(d.schema.test.tail(2)["id"].tolist(), [2, 3])
+        self.assertEqual(d.schema.test.tail(5)["id"].tolist(), [1, 2, 3])
+        # SQL Server needs an ORDER BY to use OFFSET
+        d._unordered = lambda: MSSQLDB._unordered(d)
+        statements = []
+        listen(d.engine, "before_cursor_execute",
+               lambda conn, cursor, stmt, *args: statements.append(stmt))
+        self.assertEqual(d.schema.test.tail(2)["id"].tolist(), [2, 3])
+        self.assertTrue("ORDER BY (SELECT NULL)" in statements[-1])
+
+    def test_sample(self):
+        artist = self.d.schema.Artist
+        self.assertEqual(len(artist.sample()), 10)
+        sample = artist.sample(50)
+        self.assertEqual(len(sample), 50)
+        self.assertEqual(len(sample["ArtistId"].unique()), 50)
+        self.assertEqual(len(artist.sample(frac=0.2)), 55)
+        with self.assertRaises(AttributeError):
+            artist.sample(5, frac=0.5)
+        with self.assertRaises(AttributeError):
+            artist.sample(frac=2)
+
+    def test_profile(self):
+        track = self.d.schema.Track
+        profile = track.profile()
+        self.assertEqual(
+            profile.columns.tolist(),
+            ["Column", "Type", "Count", "Nulls", "Distinct", "Min", "Max"])
+        self.assertEqual(profile["Column"].tolist(), track.columns)
+        composer = profile.set_index("Column").loc["Composer"]
+        self.assertEqual(composer["Count"] + composer["Nulls"], 3503)
+        self.assertEqual(composer["Nulls"], 978)
+        genre = profile.set_index("Column").loc["GenreId"]
+        self.assertEqual(genre[["Distinct", "Min", "Max"]].tolist(),
+                         [25, 1, 25])
+        # Cached
+        self.assertTrue(track.profile() is profile)
+
+    def test_profile_sample_and_top(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT, name TEXT, data BLOB);")
+        d.sql("INSERT INTO test VALUES (?, ?, ?);",
+              [(1, "a", None), (2, "b", b"x"), (3, "b", None), (4, None, None)])
+        profile = d.schema.test.profile(top=2).set_index("Column")
+        self.assertEqual(profile.loc["name"]["Top"], ["b", "a"])
+        self.assertEqual(profile.loc["data"][["Count", "Nulls"]].tolist(),
+                         [1, 3])
+        self.assertTrue(profile.loc["data"][["Min", "Max"]].isnull().all())
+        sampled = d.schema.test.profile(n=2)
+        self.assertEqual(sampled["Count"].iat[0], 2)
+
+    def test_foreign_keys(self):
+        self.d.schema.refresh()
+        fks = self.d.schema.foreign_keys()
+        self.assertEqual(fks.columns.tolist(),
+                         ["Table", "Column", "Foreign Table", "Foreign Key"])
+        self.assertEqual(len(fks), 11)
+        self.assertEqual(fks.iloc[0].tolist(),
+                         ["Album", "ArtistId", "Artist", "ArtistId"])
+
+    def test_table_schema(self):
+        self.d.schema.refresh()
+        ts = self.d.schema.Employee.table_schema
+        self.assertEqual(len(ts), 15)
+        self.assertEqual(ts["Reference Keys"].iat[0],
+                         "Customer.SupportRepId, Employee.ReportsTo")
+        self.assertEqual(ts["Foreign Key"].iat[4], "Employee.EmployeeId")
+
+
+class TestSchemaSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "chinook.sqlite")
+        shutil.copy(CHINOOK, self.db_path)
+        self.options = (db2.options["schema_cache"],
+                        db2.options["schema_cache_dir"])
+        db2.options["schema_cache"] = True
+        db2.options["schema_cache_dir"] = os.path.join(self.tmp_dir, "cache")
+
+    def tearDown(self):
+        (db2.options["schema_cache"],
+         db2.options["schema_cache_dir"]) = self.options
+        shutil.rmtree(self.tmp_dir)
+
+    def test_snapshot_reused(self):
+        d = SQLiteDB(self.db_path)
+        d.schema.refresh()
+        self.assertTrue(os.path.exists(d.schema._snapshot_path))
+        d.close()
+
+        d = SQLiteDB(self.db_path)
+        # First access loads every table from the snapshot
+        self.assertEqual(d.schema.Album.columns,
+                         ["AlbumId", "Title", "ArtistId"])
+        self.assertEqual(str(d.schema),
+                         "<Schema (chinook.sqlite): 11 Tables Loaded>")
+        self.assertEqual(len(d.schema.foreign_keys()), 11)
+        self.assertEqual(d.schema.Artist.count(), 275)
+        d.close()
+
+    def test_snapshot_forced_refresh(self):
+        d = SQLiteDB(self.db_path)
+        d.schema.refresh()
+        d.close()
+        d = SQLiteDB(self.db_path)
+        loaded = []
+        d.schema._load_snapshot = lambda: loaded.append(True)
+        d.schema.refresh(force=True)
+        self.assertEqual(loaded, [])
+        self.assertEqual(str(d.schema),
+                         "<Schema (chinook.sqlite): 11 Tables Loaded>")
+        d.close()
+
+    def test_snapshot_invalidated(self):
+        d = SQLiteDB(self.db_path)
+        d.schema.refresh()
+        d.sql("ALTER TABLE Artist ADD COLUMN Country TEXT;")
+        d.close()
+
+        d = SQLiteDB(self.db_path)
+        # The schema version changed, so only Artist is reflected
+        self.assertEqual(d.schema.Artist.columns,
+                         ["ArtistId", "Name", "Country"])
+        self.assertEqual(str(d.schema),
+                         "<Schema (chinook.sqlite): 1 Tables Loaded>")
+        d.close()
+
+    def test_memory_not_cached(self):
+        d = SQLiteDB(":memory:")
+        d.sql("CREATE TABLE test (id INT);")
+        d.schema.refresh()
+        self.assertFalse(os.path.exists(d.schema._snapshot_path))
+
+    def test_same_relative_name(self):
+        # Databases opened with the same relative path from different
+        # directories don't share a snapshot
+        cwd = os.getcwd()
+        for name, column in [("a", "alpha"), ("b", "beta")]:
+            os.mkdir(os.path.join(self.tmp_dir, name))
+            d = SQLiteDB(os.path.join(self.tmp_dir, name, "data.sqlite"))
+            d.sql("CREATE TABLE t ({} INT);".format(column))
+            d.close()
+        try:
+            os.chdir(os.path.join(self.tmp_dir, "a"))
+            d = SQLiteDB("data.sqlite")
+            d.schema.refresh()
+            d.close()
+            os.chdir(os.path.join(self.tmp_dir, "b"))
+            d = SQLiteDB("data.sqlite")
+            self.assertEqual(d.schema.t.columns, ["beta"])
+            d.close()
+        finally:
+            os.chdir(cwd)
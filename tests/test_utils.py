@@ -6,9 +6,10 @@ Test utils module
 from __future__ import unicode_literals
 
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta, tzinfo
 from decimal import Decimal
 
+import pandas as pd
 import sqlparse
 
 import db2
@@ -30,6 +31,55 @@ class PandasUtilsTests(unittest.TestCase):
     def setUp(self):
         pass
 
+    def test_dates_to_strs(self):
+        col = pd.Series([datetime(2020, 1, 1, 10, 0, 0, 123456), None])
+        self.assertEqual(utils.dates_to_strs(col).tolist(),
+                         ["2020-01-01 10:00:00.123456", "NaT"])
+
+    def test_decimals_to_floats(self):
+        df = pd.DataFrame([[Decimal("1.5"), "a"], [None, "b"]],
+                          columns=["D", "S"])
+        converted = utils.decimals_to_floats(df)
+        self.assertEqual(str(converted["D"].dtype), "float64")
+        self.assertEqual(converted["S"].tolist(), ["a", "b"])
+        self.assertEqual(str(utils.decimals_to_floats(df["D"]).dtype),
+                         "float64")
+
+
+class MST(tzinfo):
+    def utcoffset(self, dt):
+        return timedelta(hours=-7)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+class ColumnarFetchFunctions(unittest.TestCase):
+    def test_mixed_types(self):
+        # SQLite columns can hold any type; kinds come from the first value
+        arr = utils.column_array([1, "abc", 2], "number")
+        self.assertEqual(arr.dtype, object)
+        self.assertEqual(arr.tolist(), [1, "abc", 2])
+        arr = utils.column_array([datetime(2020, 1, 1), 5], "datetime")
+        self.assertEqual(arr.tolist(), [datetime(2020, 1, 1), 5])
+
+    def test_numbers(self):
+        self.assertEqual(utils.column_array([1, 2], "number").dtype.kind, "i")
+        arr = utils.column_array([Decimal("1.5"), None], "number")
+        self.assertEqual(arr.dtype.kind, "f")
+        self.assertEqual(arr[0], 1.5)
+
+    def test_datetimes(self):
+        arr = utils.column_array([datetime(2020, 1, 1), None], "datetime")
+        self.assertEqual(str(arr.dtype), "datetime64[ns]")
+        # Aware datetimes keep their time zone
+        tz = MST()
+        aware = [datetime(2020, 1, 1, 10, tzinfo=tz)]
+        arr = utils.column_array(aware, "datetime")
+        self.assertEqual(arr.dtype, object)
+        self.assertEqual(arr[0].hour, 10)
+        self.assertEqual(arr[0].tzinfo, tz)
+
 
 class ParsedSQLFunctions(unittest.TestCase):
     def setUp(self):
@@ -58,6 +108,63 @@ class ParsedSQLFunctions(unittest.TestCase):
         self.assertFalse(utils.is_query(statement2))
         self.assertFalse(utils.is_query(statement3))
 
+    def test_split_sql(self):
+        script = open("tests/many_statements.sql").read()
+        parsed = utils.split_sql(script)
+        self.assertEqual(len(parsed), 11)
+        self.assertTrue(parsed[5].value.strip().endswith("END;"))
+        self.assertFalse(any(s.is_query for s in parsed))
+        # Cached
+        self.assertTrue(utils.split_sql(script) is parsed)
+
+    def test_iter_statements(self):
+        with open("tests/many_statements.sql") as f:
+            statements = list(utils.iter_statements(f))
+        # Agrees with split_sql, less the trailing blank statement
+        self.assertEqual(statements, [
+            s.value.strip() for s in utils.split_sql(
+                open("tests/many_statements.sql").read())][:-1])
+        script = (
+            "CREATE FUNCTION f() RETURNS int AS $$ BEGIN; RETURN 1; END; "
+            "$$ LANGUAGE plpgsql; -- comment;\n"
+            "SELECT 'a''b;' /* ; */ ;\n"
+            "CREATE TRIGGER t AFTER INSERT ON x BEGIN\n"
+            "  UPDATE y SET a = CASE WHEN 1 THEN 2 END;\n"
+            "END;\n"
+            "SELECT [a;b] FROM \"c;\" -- unterminated\n")
+        self.assertEqual(
+            list(utils.iter_statements(script.splitlines(True))),
+            ["CREATE FUNCTION f() RETURNS int AS $$ BEGIN; RETURN 1; END; "
+             "$$ LANGUAGE plpgsql;",
+             "-- comment;\nSELECT 'a''b;' /* ; */ ;",
+             "CREATE TRIGGER t AFTER INSERT ON x BEGIN\n"
+             "  UPDATE y SET a = CASE WHEN 1 THEN 2 END;\nEND;",
+             "SELECT [a;b] FROM \"c;\" -- unterminated"])
+
+    def test_split_simple(self):
+        # The fast path must agree with sqlparse whenever it is used
+        statements = [
+            "SELECT * FROM sqlite_master",
+            "SELECT a, b FROM test WHERE a = 1;",
+            "  SELECT a FROM test ;  ",
+            "\nCREATE TABLE test (id INT, name TEXT);",
+            "INSERT INTO test VALUES (1, 'Aerosmith')",
+            "SELECT count(*) FROM test",
+            "SELECT ExampleFunction()",
+            "WITH x AS (SELECT 1) SELECT * FROM x",
+            "SELECT 1;\n",
+            "SELECT ';' FROM test",
+            "SELECT * FROM test -- comment",
+            "PRAGMA table_info('test');",
+            "(SELECT 1)"]
+        fast = 0
+        for sql in statements:
+            simple = utils._split_simple(sql)
+            if simple is not None:
+                fast += 1
+                self.assertEqual(simple, utils._split_parsed(sql))
+        self.assertEqual(fast, 7)
+
 
 class SQLFunctionTests(unittest.TestCase):
     def setUp(self):
@@ -67,3 +174,94 @@ class SQLFunctionTests(unittest.TestCase):
         d = db2.SQLiteDB(":memory:", functions=[utils.pystrftime])
         month = d.sql("SELECT pystrftime('%b', '2020-01-01') AS abbr;")
         self.assertEqual(month["abbr"].iat[0], "Jan")
+
+    def test_pystrftime_formats(self):
+        self.assertEqual(utils.pystrftime("%Y %j", "2020-02-01"), "2020 032")
+        self.assertEqual(utils.pystrftime("%I:%M %p", "2020-01-01T13:45"),
+                         "01:45 PM")
+        self.assertEqual(
+            utils.pystrftime("%S.%f", "2020-01-01 00:00:07.25"), "07.250000")
+        # Not ISO-8601: parsed by dateutil
+        self.assertEqual(utils.pystrftime("%Y-%m-%d", "Jan 5, 2020"),
+                         "2020-01-05")
+        self.assertEqual(utils.pystrftime("%H", "2020-01-01 05:00+02:00"),
+                         "05")
+
+    def test_aggregate_and_window(self):
+        class pysum(object):
+            def __init__(self):
+                self.total = 0
+
+            def step(self, value):
+                self.total += value
+
+            def inverse(self, value):
+                self.total -= value
+
+            def value(self):
+                return self.total
+
+            def finalize(self):
+                return self.total
+
+        @utils.sqlite_function(name="pyproduct")
+        class Product(object):
+            def __init__(self):
+                self.total = 1
+
+            def step(self, value):
+                self.total *= value
+
+            def finalize(self):
+                return self.total
+
+        d = db2.SQLiteDB(":memory:", functions=[pysum, Product])
+        d.sql("CREATE TABLE t (x INT);")
+        d.sql("INSERT INTO t VALUES (1), (2), (3), (4);")
+        r = d.sql("SELECT pysum(x) AS s, pyproduct(x) AS p FROM t")
+        self.assertEqual(r.values.tolist(), [[10, 24]])
+        r = d.sql("SELECT x, pysum(x) OVER (ORDER BY x ROWS BETWEEN 1 "
+                  "PRECEDING AND CURRENT ROW) AS s FROM t")
+        self.assertEqual(r["s"].tolist(), [1, 3, 5, 7])
+
+    def test_deterministic(self):
+        calls = []
+
+        @utils.sqlite_function(deterministic=True, cache_size=2)
+        def tag(value):
+            calls.append(value)
+            return "<{}>".format(value)
+
+        d = db2.SQLiteDB(":memory:", functions=[tag])
+        d.sql("CREATE TABLE t (name TEXT);")
+        d.sql("INSERT INTO t VALUES ('a'), ('b'), ('a'), ('a');")
+        r = d.sql("SELECT name, tag(name) AS tagged FROM t")
+        self.assertEqual(r["tagged"].tolist(), ["<a>", "<b>", "<a>", "<a>"])
+        # Memoized
+        self.assertEqual(calls, ["a", "b"])
+        # Only deterministic functions can be used in index expressions
+        d.sql("CREATE INDEX t_tag ON t (tag(name));")
+
+    def test_memoize_types(self):
+        show = utils._memoize(repr, 10)
+        self.assertEqual([show(1), show(1.0), show(True)],
+                         ["1", "1.0", "True"])
+
+
+class LRUCacheTests(unittest.TestCase):
+    def test_eviction(self):
+        cache = utils.LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertEqual(cache.info()["hits"], 1)
+
+    def test_disabled(self):
+        cache = utils.LRUCache(0)
+        cache.put("a", 1)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.misses, 1)